@@ -1,7 +1,12 @@
 from flask import Flask, render_template, jsonify, Response, request, send_from_directory
 import os
+import time
+import functools
+import threading
 from datetime import datetime
 
+from result_store import ResultStore
+
 # 重いライブラリは起動時例外を避けるため遅延インポート/ガード
 LIBS_OK = True
 _import_error_message = None
@@ -13,10 +18,22 @@ try:
         extract_landmarks,
         draw_landmarks, 
         calculate_differences,
+        calculate_differences_batch,
+        extract_all_landmarks,
         FaceFeatureAnalyzer,
         LANDMARK_POINTS,
         mp_face_mesh
     )
+    from frame_quality import (  # type: ignore
+        check_frame_quality,
+        select_sharpest_frame,
+        QUALITY_MESSAGES
+    )
+    from landmark_smoothing import robust_median_landmarks  # type: ignore
+    from multi_face import FaceTracker, match_baselines  # type: ignore
+    from capture_archive import CaptureArchive, is_immutable_name  # type: ignore
+    from frame_pipeline import FramePipeline  # type: ignore
+    from frame_source import open_frame_source  # type: ignore
 except Exception as _e:  # ImportError など
     LIBS_OK = False
     _import_error_message = str(_e)
@@ -29,21 +46,75 @@ app = Flask(__name__)
 # グローバル変数（Web特有の状態管理）
 camera = None
 face_mesh_instance = None
-capture_result = None
-comparison_result = None
+# 撮影/比較結果（バージョン付き。/get_results と /results/stream で配信）
+result_store = ResultStore(capture_result=None, comparison_result=None)
+# 基準ランドマーク（撮影/アップロード時に保持し、比較時の再推論を省く）
+baseline_landmarks = None
+# baseline_landmarks を取得した時点の過去画像の (mtime_ns, size)。別ワーカーでの更新検出に使う
+baseline_stamp = None
+# 複数顔モード（顔IDごとの基準ランドマーク）
+multi_face_mesh_instance = None
+face_tracker = None
+multi_face_baselines = {}
+
+# FaceMesh とカメラはスレッドセーフではないため、推論を伴う処理とそれらの開始・停止は直列化する
+inference_lock = threading.RLock()
+
+def serialized(func):
+    """inference_lock を保持したまま関数を実行するデコレータ"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with inference_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+# ストリーミング用のフレームパイプライン（事前確保したバッファ上で処理）
+video_pipeline = FramePipeline() if LIBS_OK else None
+
+# 特徴記述の生成器（ルール表はコンパイル済みのものを共有）
+feature_analyzer = FaceFeatureAnalyzer() if LIBS_OK else None
+
+# フレームソース（カメラ番号 / "file:..." / "images:..." / "synthetic:WxH@FPS"）
+FRAME_SOURCE = os.environ.get("FRAME_SOURCE", "0")
 
 # ファイル保存設定
 SAVE_DIR = "captures"
 os.makedirs(SAVE_DIR, exist_ok=True)
 PAST_IMAGE_PATH = os.path.join(SAVE_DIR, "past.jpg")
-
+# 撮影画像の保存・保持期間管理（ランドマークも画像の隣に保存）
+archive = CaptureArchive(SAVE_DIR) if LIBS_OK else None
+# コンテンツハッシュ付きの撮影画像は内容が変わらないため長期キャッシュさせる
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# カメラ撮影時に連続取得するフレーム数（最もシャープなものを採用）
+CAPTURE_BURST_SIZE = 5
+
+# カメラ撮影モード
+#   "single":   バーストから最良の1フレームを使用
+#   "averaged": 短い時間窓でトラッキングし、ランドマークのロバストな中央値を使用
+CAPTURE_MODE = "single"
+CAPTURE_MODES = ("single", "averaged")
+CAPTURE_WINDOW_FRAMES = 9        # 平均化に使うフレーム数
+CAPTURE_LATENCY_BUDGET = 1.5     # 平均化にかける最大時間（秒）
+# リクエストで上書きできる範囲（撮影1回にかかる時間に上限を設ける）
+CAPTURE_WINDOW_RANGE = (1, 30)
+CAPTURE_MAX_BUDGET = 5.0
+
+# 複数顔モードで同時に検出する最大人数
+MAX_NUM_FACES = 5
+# 見失った顔のIDを保持するフレーム数（ストリームで約3秒）。これを過ぎたIDの基準は破棄する
+MULTI_TRACK_MAX_MISSED = 90
+# トラッカーの前回更新からこれ以上空いた場合、IDは位置のみで対応付けたものとみなす（秒）
+MULTI_TRACK_MAX_GAP = 1.0
+
+@serialized
 def start_camera():
     """カメラ開始"""
     global camera, face_mesh_instance
     if not LIBS_OK:
         return False
     try:
-        camera = cv2.VideoCapture(0)
+        camera = open_frame_source(FRAME_SOURCE)
         face_mesh_instance = mp_face_mesh.FaceMesh(
             static_image_mode=False,
             max_num_faces=1,
@@ -55,6 +126,7 @@ def start_camera():
         print(f"カメラ開始エラー: {e}")
         return False
 
+@serialized
 def stop_camera():
     """カメラ停止"""
     global camera, face_mesh_instance
@@ -78,65 +150,237 @@ def init_face_mesh():
         min_tracking_confidence=0.5
     )
 
-def capture_current_frame():
-    """現在のフレームを撮影"""
-    global capture_result
+def read_best_frame():
+    """短いバーストを取得し、品質チェックで最良のフレームを返す
+
+    戻り値は (frame, error_message)。
+    """
+    frames = []
+    for _ in range(CAPTURE_BURST_SIZE):
+        # ストリームを止めないよう、ロックは1フレームごとに取得する
+        with inference_lock:
+            if camera is None:
+                break
+            ret, frame = camera.read()
+        if ret:
+            frames.append(frame)
+    if not frames:
+        return None, "フレームの取得に失敗しました"
+
+    frame, quality = select_sharpest_frame(frames)
+    if not quality["ok"]:
+        return None, QUALITY_MESSAGES[quality["reason"]]
+    return frame, None
+
+def read_averaged_landmarks(window=None, budget=None):
+    """時間窓内のフレームをトラッキングし、ランドマークのロバストな中央値を返す
+
+    中央値は生のランドマークから取る（窓が短いため時系列フィルタを通すと
+    先頭フレームに引きずられるだけで精度は上がらない）。
+    戻り値は (代表フレーム, landmarks, error_message)。
+    代表フレームは中央値に最も近いランドマークを持つフレーム。
+    """
+    window = window or CAPTURE_WINDOW_FRAMES
+    budget = budget or CAPTURE_LATENCY_BUDGET
+    deadline = time.monotonic() + budget
+
+    frames = []
+    samples = []
+    quality_error = None
+    while len(samples) < window and time.monotonic() < deadline:
+        # 窓全体ではなく1フレームごとにロックを取り、その間もストリームを配信できるようにする
+        with inference_lock:
+            if camera is None:
+                return None, None, "カメラが停止されました"
+            ret, frame = camera.read()
+        if not ret:
+            continue
+        # ブレや露出不良のフレームは平均に含めない
+        ok, reason = check_frame_quality(frame, check_face=False)
+        if not ok:
+            quality_error = reason
+            continue
+        with inference_lock:
+            if face_mesh_instance is None:
+                return None, None, "カメラが停止されました"
+            landmarks = extract_landmarks(frame, face_mesh_instance)
+        if landmarks is None:
+            continue
+        frames.append(frame)
+        samples.append(landmarks)
+
+    if not samples:
+        return None, None, quality_error or "顔が検出されませんでした"
+
+    stack = np.stack(samples)
+    median, _ = robust_median_landmarks(stack)
+    errors = np.linalg.norm(stack - median, axis=2).mean(axis=1)
+    return frames[int(np.argmin(errors))], median, None
+
+def parse_capture_options(options):
+    """リクエストの撮影オプション（"mode" / "window" / "budget"（秒））を検証する
+
+    window と budget は数値に変換して許容範囲に丸める。
+    戻り値は (正規化したオプション, error_message)。
+    """
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        return None, "撮影オプションの形式が不正です"
+
+    mode = options.get("mode") or CAPTURE_MODE
+    if not isinstance(mode, str) or mode not in CAPTURE_MODES:
+        return None, f"撮影モードは {' / '.join(CAPTURE_MODES)} のいずれかを指定してください"
+
+    window = options.get("window")
+    budget = options.get("budget")
+    try:
+        window = None if window is None else int(float(window))
+    except (TypeError, ValueError, OverflowError):
+        return None, "window はフレーム数（整数）で指定してください"
+    try:
+        budget = None if budget is None else float(budget)
+    except (TypeError, ValueError):
+        budget = float("nan")
+    if budget is not None and not budget > 0:
+        return None, "budget は正の秒数で指定してください"
+
+    if window is not None:
+        window = min(max(window, CAPTURE_WINDOW_RANGE[0]), CAPTURE_WINDOW_RANGE[1])
+    if budget is not None:
+        budget = min(budget, CAPTURE_MAX_BUDGET)
+    return {"mode": mode, "window": window, "budget": budget}, None
+
+def read_frame_and_landmarks(options):
+    """撮影モードに応じてフレームとランドマークを取得
+
+    options は parse_capture_options で検証済みのもの。
+    戻り値は (frame, landmarks, error_message)。
+    """
+    if options["mode"] == "averaged":
+        return read_averaged_landmarks(options["window"], options["budget"])
+
+    frame, error = read_best_frame()
+    if frame is None:
+        return None, None, error
+    with inference_lock:
+        if face_mesh_instance is None:
+            return None, None, "カメラが停止されました"
+        landmarks = extract_landmarks(frame, face_mesh_instance)
+    if landmarks is None:
+        return None, None, "顔が検出されませんでした"
+    return frame, landmarks, None
+
+def capture_current_frame(options=None):
+    """現在のフレームを撮影
+
+    カメラ/FaceMesh を使う区間だけ inference_lock を取る（撮影中もストリームは止まらない）。
+    """
     if not LIBS_OK:
         return {"success": False, "message": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}
+    options, error = parse_capture_options(options)
+    if error:
+        return {"success": False, "message": error}
     if camera is None:
         return {"success": False, "message": "カメラが開始されていません"}
     
-    ret, frame = camera.read()
-    if not ret:
-        return {"success": False, "message": "フレームの取得に失敗しました"}
-    
-    # 元のモジュールの関数を使用
-    landmarks = extract_landmarks(frame, face_mesh_instance)
-    if landmarks is None:
-        return {"success": False, "message": "顔が検出されませんでした"}
+    frame, landmarks, error = read_frame_and_landmarks(options)
+    if frame is None:
+        return {"success": False, "message": error}
     
     # 撮影処理
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    raw_path = os.path.join(SAVE_DIR, f"{timestamp}_raw.jpg")
-    lm_path = os.path.join(SAVE_DIR, f"{timestamp}_landmarks.jpg")
 
-    # 生画像保存
-    cv2.imwrite(raw_path, frame)
+    # 生画像保存（ランドマークとサムネイルも併せて保存）
+    raw = archive.store_image(timestamp, "raw", frame, landmarks=landmarks, thumbnail=True)
 
     # 元のモジュールの関数を使用してランドマーク描画
-    lm_frame = draw_landmarks(frame.copy(), landmarks)
-    cv2.imwrite(lm_path, lm_frame)
+    lm_frame = draw_landmarks(frame.copy(), np.rint(landmarks).astype(int))
+    lm = archive.store_image(timestamp, "landmarks", lm_frame)
 
     # 過去画像更新
-    cv2.imwrite(PAST_IMAGE_PATH, frame)
+    set_baseline_landmarks(frame, landmarks)
 
-    capture_result = {
+    result_store.update(capture_result={
         "timestamp": timestamp,
-        "raw_path": raw_path,
-        "landmarks_path": lm_path
-    }
+        "raw_path": os.path.join(SAVE_DIR, raw["image"]),
+        "landmarks_path": os.path.join(SAVE_DIR, lm["image"]),
+        "raw_url": f"/captures/{raw['image']}",
+        "landmarks_url": f"/captures/{lm['image']}",
+        "thumbnail_url": f"/captures/{raw['thumbnail']}"
+    })
     
     return {"success": True, "message": "撮影が完了しました"}
 
-def compare_current_frame():
-    """現在のフレームと過去の画像を比較"""
-    global comparison_result
+def publish_comparison(diffs, descriptions):
+    """比較結果を保存し、結果ページへ通知"""
+    # 有意な変化の検出
+    significant_changes = [k for k, v in diffs.items() if abs(v['change_percent']) > 5.0]
+    
+    result_store.update(comparison_result={
+        "numerical_data": diffs,
+        "descriptions": descriptions,
+        "significant_changes": significant_changes,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
+    })
+
+def _past_image_stamp():
+    """過去画像の (mtime_ns, size)。存在しなければ None"""
+    try:
+        stat = os.stat(PAST_IMAGE_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def set_baseline_landmarks(image, landmarks):
+    """過去画像とランドマークを保存し、このワーカーの保持分も更新"""
+    global baseline_landmarks, baseline_stamp
+    archive.set_past(PAST_IMAGE_PATH, image, landmarks)
+    baseline_landmarks = landmarks
+    baseline_stamp = _past_image_stamp()
+
+@serialized
+def get_baseline_landmarks():
+    """基準ランドマークを取得
+
+    過去画像が保持時点から変わっていれば（他のワーカーが更新した場合など）、
+    保存済みランドマーク、なければ過去画像からの抽出で読み直す。
+    """
+    global baseline_landmarks, baseline_stamp
+    stamp = _past_image_stamp()
+    if stamp is None:
+        baseline_landmarks, baseline_stamp = None, None
+        return None
+    if baseline_landmarks is not None and stamp == baseline_stamp:
+        return baseline_landmarks
+
+    landmarks = archive.load_past_landmarks(PAST_IMAGE_PATH)
+    if landmarks is None:
+        past_img = cv2.imread(PAST_IMAGE_PATH)
+        if past_img is not None:
+            landmarks = extract_landmarks(past_img, face_mesh_instance)
+    baseline_landmarks, baseline_stamp = landmarks, stamp
+    return baseline_landmarks
+
+def compare_current_frame(options=None):
+    """現在のフレームと過去の画像を比較（ロックの扱いは capture_current_frame と同じ）"""
     if not LIBS_OK:
         return {"success": False, "message": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}
+    options, error = parse_capture_options(options)
+    if error:
+        return {"success": False, "message": error}
     if camera is None:
         return {"success": False, "message": "カメラが開始されていません"}
     
     if not os.path.exists(PAST_IMAGE_PATH):
         return {"success": False, "message": "先に撮影を行ってください"}
     
-    ret, frame = camera.read()
-    if not ret:
-        return {"success": False, "message": "フレームの取得に失敗しました"}
+    frame, current_lm, error = read_frame_and_landmarks(options)
+    if frame is None:
+        return {"success": False, "message": error}
     
     # 元のモジュールの関数を使用
-    past_img = cv2.imread(PAST_IMAGE_PATH)
-    past_lm = extract_landmarks(past_img, face_mesh_instance)
-    current_lm = extract_landmarks(frame, face_mesh_instance)
+    past_lm = get_baseline_landmarks()
     
     if past_lm is None or current_lm is None:
         return {"success": False, "message": "顔が検出されませんでした"}
@@ -145,18 +389,9 @@ def compare_current_frame():
     diffs = calculate_differences(past_lm, current_lm)
     
     # 元のモジュールのクラスを使用してAI分析
-    analyzer = FaceFeatureAnalyzer()
-    descriptions = analyzer.generate_feature_descriptions(diffs)
+    descriptions = feature_analyzer.generate_feature_descriptions(diffs)
     
-    # 有意な変化の検出
-    significant_changes = [k for k, v in diffs.items() if abs(v['change_percent']) > 5.0]
-    
-    comparison_result = {
-        "numerical_data": diffs,
-        "descriptions": descriptions,
-        "significant_changes": significant_changes,
-        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S")
-    }
+    publish_comparison(diffs, descriptions)
     
     return {"success": True, "message": "比較分析が完了しました"}
 
@@ -176,7 +411,15 @@ def health():
 # 静的に保存した撮影ファイル配信用
 @app.route('/captures/<path:filename>')
 def serve_captures(filename):
-    return send_from_directory(SAVE_DIR, filename, as_attachment=False)
+    if LIBS_OK and is_immutable_name(filename):
+        response = send_from_directory(SAVE_DIR, filename, as_attachment=False, max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    # past.jpg など上書きされるファイルは毎回 ETag で再検証させる
+    response = send_from_directory(SAVE_DIR, filename, as_attachment=False, max_age=0)
+    response.cache_control.no_cache = True
+    return response
 
 # ブラウザの自動リクエストに対する簡易favicon応答（404抑止）
 @app.route('/favicon.ico')
@@ -184,59 +427,94 @@ def favicon():
     return ("", 204)
 
 # ========== アップロード型フロー API ==========
+def decode_image_bytes(data):
+    """画像のバイト列をOpenCV画像にデコード"""
+    file_bytes = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)  # type: ignore
+
 def _read_uploaded_image_to_cv2(upload_file):
-    import io
-    import numpy as np  # type: ignore
-    file_bytes = np.frombuffer(upload_file.read(), dtype=np.uint8)
-    img = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)  # type: ignore
-    return img
+    return decode_image_bytes(upload_file.read())
 
-@app.route('/upload_base', methods=['POST'])
-def upload_base():
-    if not LIBS_OK:
-        return jsonify({"success": False, "error": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}), 500
-    if 'image' not in request.files:
-        return jsonify({"success": False, "error": "画像ファイルがありません"}), 400
-    file = request.files['image']
-    if file.filename == '':
-        return jsonify({"success": False, "error": "ファイル名が不正です"}), 400
-
-    img = _read_uploaded_image_to_cv2(file)
-    if img is None:
-        return jsonify({"success": False, "error": "画像の読み込みに失敗しました"}), 400
+@serialized
+def process_base_image(img):
+    """基準画像を設定し (payload, status) を返す"""
+    # 推論前の品質チェック
+    ok, reason = check_frame_quality(img)
+    if not ok:
+        return {"success": False, "error": reason}, 200
 
     # ランドマーク抽出
-    global face_mesh_instance
     if face_mesh_instance is None:
         init_face_mesh()
     lms = extract_landmarks(img, face_mesh_instance)
     if lms is None:
-        return jsonify({"success": False, "error": "顔が検出されませんでした"}), 200
+        return {"success": False, "error": "顔が検出されませんでした"}, 200
 
     # 保存
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    raw_name = f"{timestamp}_base_raw.jpg"
-    lm_name = f"{timestamp}_base_landmarks.jpg"
-    raw_path = os.path.join(SAVE_DIR, raw_name)
-    lm_path = os.path.join(SAVE_DIR, lm_name)
-
-    cv2.imwrite(raw_path, img)  # type: ignore
+    archive.store_image(timestamp, "base_raw", img, landmarks=lms, thumbnail=True)
     lm_img = draw_landmarks(img.copy(), lms)
-    cv2.imwrite(lm_path, lm_img)  # type: ignore
+    lm = archive.store_image(timestamp, "base_landmarks", lm_img)
 
     # 過去画像として確定
-    cv2.imwrite(PAST_IMAGE_PATH, img)  # type: ignore
+    set_baseline_landmarks(img, lms)
 
-    return jsonify({
+    return {
         "success": True,
         "message": "基準画像を設定しました",
-        "landmark_image": f"/captures/{lm_name}"
-    })
+        "landmark_image": f"/captures/{lm['image']}"
+    }, 200
+
+@serialized
+def process_compare_image(current_img):
+    """基準画像と比較し (payload, status) を返す"""
+    # 推論前の品質チェック
+    ok, reason = check_frame_quality(current_img)
+    if not ok:
+        return {"success": False, "error": reason}, 200
+
+    # ランドマーク
+    if face_mesh_instance is None:
+        init_face_mesh()
+    past_lm = get_baseline_landmarks()
+    current_lm = extract_landmarks(current_img, face_mesh_instance)
+    if past_lm is None or current_lm is None:
+        return {"success": False, "error": "顔が検出されませんでした"}, 200
+
+    diffs = calculate_differences(past_lm, current_lm)
+    descriptions = feature_analyzer.generate_feature_descriptions(diffs)
+    publish_comparison(diffs, descriptions)
+
+    return {
+        "success": True,
+        "differences": diffs,
+        "descriptions": descriptions
+    }, 200
+
+@app.route('/upload_base', methods=['POST'])
+def upload_base():
+    if not LIBS_OK:
+        return jsonify({"success": False, "error": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}), 500
+    if 'image' not in request.files:
+        return jsonify({"success": False, "error": "画像ファイルがありません"}), 400
+    file = request.files['image']
+    if file.filename == '':
+        return jsonify({"success": False, "error": "ファイル名が不正です"}), 400
+
+    img = _read_uploaded_image_to_cv2(file)
+    if img is None:
+        return jsonify({"success": False, "error": "画像の読み込みに失敗しました"}), 400
+
+    payload, status = process_base_image(img)
+    return jsonify(payload), status
 
 @app.route('/compare', methods=['POST'])
 def compare_uploaded():
     if not LIBS_OK:
         return jsonify({"success": False, "error": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}), 500
+    # 画像なしでカメラ稼働中ならカメラ比較として扱う（同一URLのため）
+    if 'image' not in request.files and camera is not None:
+        return compare_route()
     if not os.path.exists(PAST_IMAGE_PATH):
         return jsonify({"success": False, "error": "先に基準画像をアップロードしてください"}), 200
     if 'image' not in request.files:
@@ -249,25 +527,168 @@ def compare_uploaded():
     if current_img is None:
         return jsonify({"success": False, "error": "画像の読み込みに失敗しました"}), 400
 
-    # ランドマーク
-    global face_mesh_instance
-    if face_mesh_instance is None:
-        init_face_mesh()
-    past_img = cv2.imread(PAST_IMAGE_PATH)  # type: ignore
-    past_lm = extract_landmarks(past_img, face_mesh_instance)
-    current_lm = extract_landmarks(current_img, face_mesh_instance)
-    if past_lm is None or current_lm is None:
-        return jsonify({"success": False, "error": "顔が検出されませんでした"}), 200
+    payload, status = process_compare_image(current_img)
+    return jsonify(payload), status
 
-    diffs = calculate_differences(past_lm, current_lm)
-    analyzer = FaceFeatureAnalyzer()
-    descriptions = analyzer.generate_feature_descriptions(diffs)
+# ========== 複数顔モード API ==========
+def init_multi_face_mesh():
+    global multi_face_mesh_instance, face_tracker
+    multi_face_mesh_instance = mp_face_mesh.FaceMesh(
+        static_image_mode=False,
+        max_num_faces=MAX_NUM_FACES,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+    face_tracker = FaceTracker(max_missed=MULTI_TRACK_MAX_MISSED)
+
+def _prepare_multi_face_input(img):
+    """画像がなければカメラのフレームを使用
+
+    戻り値は (image, error_message, status)。
+    """
+    if img is not None:
+        ok, reason = check_frame_quality(img)
+        if not ok:
+            return None, reason, 200
+        return img, None, 200
+    if camera is None:
+        return None, "画像ファイルがありません", 400
+    frame, error = read_best_frame()
+    if frame is None:
+        return None, error, 200
+    return frame, None, 200
+
+def _update_face_tracker(faces):
+    """トラッカーを更新し、見失ったIDの基準を破棄してIDを返す"""
+    ids = face_tracker.update(faces)
+    for face_id in set(multi_face_baselines) - face_tracker.active_ids:
+        del multi_face_baselines[face_id]
+    return ids
+
+def track_stream_faces(frame):
+    """複数顔モード中（基準登録済み）はストリームの各フレームでトラッカーを更新する
+
+    リクエスト間（数分空くこともある）の位置だけで対応付けると、人が入れ替わった場合に
+    別人の基準と比較してしまうため、映像上で連続して追跡しておく。
+    """
+    if multi_face_baselines and multi_face_mesh_instance is not None:
+        _update_face_tracker(extract_all_landmarks(frame, multi_face_mesh_instance))
+
+def _detect_faces(img):
+    """全ての顔を一度の推論で検出し、(faces (F, 478, 2), ids (F,), continuous) を返す
+
+    continuous はストリームで連続追跡されていたか（False ならIDは前回リクエストとの位置の対応のみ）。
+    """
+    if multi_face_mesh_instance is None:
+        init_multi_face_mesh()
+    gap = face_tracker.seconds_since_update()
+    continuous = gap is not None and gap <= MULTI_TRACK_MAX_GAP
+    faces = extract_all_landmarks(img, multi_face_mesh_instance)
+    ids = _update_face_tracker(faces)
+    return faces, ids, continuous
+
+@serialized
+def process_multi_capture(img=None):
+    """複数顔の基準を一括登録し (payload, status) を返す"""
+    img, error, status = _prepare_multi_face_input(img)
+    if img is None:
+        return {"success": False, "error": error}, status
+
+    faces, ids, _ = _detect_faces(img)
+    if faces is None:
+        return {"success": False, "error": "顔が検出されませんでした"}, 200
 
-    return jsonify({
+    for face_id, lms in zip(ids, faces):
+        multi_face_baselines[int(face_id)] = lms
+
+    # IDラベル付きのランドマーク画像を保存
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    lm_img = img
+    for face_id, lms in zip(ids, faces):
+        lm_img = draw_landmarks(lm_img, lms)
+        x, y = lms[LANDMARK_POINTS['KEY_POINTS']['forehead']]
+        cv2.putText(lm_img, f"ID {face_id}", (int(x) - 20, int(y) - 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+    lm = archive.store_image(timestamp, "multi_landmarks", lm_img, landmarks=faces)
+
+    return {
         "success": True,
-        "differences": diffs,
-        "descriptions": descriptions
-    })
+        "message": f"{len(faces)}人の基準を設定しました",
+        "face_ids": [int(i) for i in ids],
+        "landmark_image": f"/captures/{lm['image']}"
+    }, 200
+
+@serialized
+def process_multi_compare(img=None):
+    """1フレーム内の全ての顔をそれぞれの基準と一括比較し (payload, status) を返す"""
+    if not multi_face_baselines:
+        return {"success": False, "error": "先に基準を登録してください"}, 200
+    img, error, status = _prepare_multi_face_input(img)
+    if img is None:
+        return {"success": False, "error": error}, status
+
+    faces, ids, continuous = _detect_faces(img)
+    if faces is None:
+        return {"success": False, "error": "顔が検出されませんでした"}, 200
+
+    index, past, unmatched = match_baselines(ids, multi_face_baselines)
+    if past is None:
+        return {"success": False, "error": "基準と一致する顔がありません", "unmatched_ids": unmatched}, 200
+
+    # 対応が取れた全ての顔を一括で差異計算
+    all_diffs = calculate_differences_batch(past, faces[index])
+    all_descriptions = feature_analyzer.generate_descriptions_batch(all_diffs)
+    results_by_face = []
+    for i, diffs, descriptions in zip(index, all_diffs, all_descriptions):
+        results_by_face.append({
+            "face_id": int(ids[i]),
+            "differences": diffs,
+            "descriptions": descriptions,
+            "significant_changes": [k for k, v in diffs.items() if abs(v['change_percent']) > 5.0]
+        })
+
+    return {
+        "success": True,
+        "faces": results_by_face,
+        "unmatched_ids": unmatched,
+        # False の場合、IDは前回リクエストとの位置の対応のみ（入れ替わりは検出できない）
+        "continuous_tracking": continuous
+    }, 200
+
+def _read_optional_upload():
+    """任意のアップロード画像を読み込み (image, error_message, status) を返す"""
+    if 'image' not in request.files:
+        return None, None, 200
+    file = request.files['image']
+    if file.filename == '':
+        return None, "ファイル名が不正です", 400
+    img = _read_uploaded_image_to_cv2(file)
+    if img is None:
+        return None, "画像の読み込みに失敗しました", 400
+    return img, None, 200
+
+@app.route('/multi/capture', methods=['POST'])
+def multi_capture():
+    """複数顔の基準を一括登録"""
+    if not LIBS_OK:
+        return jsonify({"success": False, "error": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}), 500
+    img, error, status = _read_optional_upload()
+    if error:
+        return jsonify({"success": False, "error": error}), status
+    payload, status = process_multi_capture(img)
+    return jsonify(payload), status
+
+@app.route('/multi/compare', methods=['POST'])
+def multi_compare():
+    """1フレーム内の全ての顔をそれぞれの基準と一括比較"""
+    if not LIBS_OK:
+        return jsonify({"success": False, "error": f"依存ライブラリの読み込みに失敗しました: {_import_error_message}"}), 500
+    img, error, status = _read_optional_upload()
+    if error:
+        return jsonify({"success": False, "error": error}), status
+    payload, status = process_multi_compare(img)
+    return jsonify(payload), status
 
 @app.route('/results')
 def results():
@@ -294,23 +715,88 @@ def stop_camera_route():
 @app.route('/capture', methods=['POST'])
 def capture_route():
     """撮影API"""
-    result = capture_current_frame()
+    result = capture_current_frame(request.get_json(silent=True))
     return jsonify(result)
 
 @app.route('/compare', methods=['POST'])
 def compare_route():
     """比較API"""
-    result = compare_current_frame()
+    result = compare_current_frame(request.get_json(silent=True))
     return jsonify(result)
 
+def _results_response(version, etag, body):
+    response = Response(body, mimetype='application/json')
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Results-Version'] = str(version)
+    return response
+
 @app.route('/get_results')
 def get_results():
-    """結果取得API"""
-    global capture_result, comparison_result
-    return jsonify({
-        "capture_result": capture_result,
-        "comparison_result": comparison_result
-    })
+    """結果取得API
+
+    If-None-Match が現在のETagと一致すれば 304 を返す。
+    同期ワーカーを占有しないよう待機はしない（ロングポーリング/SSE は asgi.py のみ）。
+    """
+    if result_store.version_for_etag(request.headers.get('If-None-Match')) is not None:
+        _, etag, _ = result_store.snapshot()
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        return response
+    return _results_response(*result_store.snapshot())
+
+# /video_feed の X-Frame-Seq-Scope
+#   "shared-source": 各視聴者がカメラから交互にフレームを読む（Flask）。
+#                    欠番には他の視聴者へ渡ったフレームも含まれるため、フレーム落ちの指標にならない
+#   "broadcast":     全視聴者に同じフレーム列を配信する（asgi.py）。欠番はその視聴者が受け取れなかったフレーム
+FRAME_SEQ_SCOPE_SHARED = "shared-source"
+FRAME_SEQ_SCOPE_BROADCAST = "broadcast"
+
+# フレームを取得できなかったときにストリームが再試行するまでの待ち時間（秒）
+STREAM_RETRY_INTERVAL = 0.01
+
+@serialized
+def ensure_video_camera():
+    """ストリーミング用にカメラとFaceMeshを準備"""
+    global camera
+    if camera is None:
+        camera = open_frame_source(FRAME_SOURCE)
+        init_face_mesh()
+
+@serialized
+def read_video_frame():
+    """カメラからリングのスロットへ直接1フレーム取得し、ランドマークを抽出
+
+    戻り値は (slot, landmarks)。失敗時は (None, None)。
+    slot は encode_video_frame で解放される。
+    """
+    if camera is None:
+        return None, None
+    slot = video_pipeline.capture(camera)
+    if slot is None:
+        return None, None
+    track_stream_faces(slot.array)
+    return slot, video_pipeline.infer(slot, face_mesh_instance)
+
+def encode_video_frame(slot, landmarks):
+    """スロット上にランドマークとガイドを描画してJPEG化し、スロットを解放
+
+    戻り値は (JPEGバッファ, フレーム通し番号)。
+    """
+    with slot:
+        video_pipeline.annotate(slot, landmarks)
+        return video_pipeline.encode(slot), slot.seq
+
+def mjpeg_part(buffer, seq=None):
+    """エンコード結果から multipart の1パートを組み立てる（コピーは1回のみ）
+
+    X-Frame-Seq はフレームソースの通し番号。欠番の意味はレスポンスの
+    X-Frame-Seq-Scope で示す（FRAME_SEQ_SCOPE_* を参照）。
+    """
+    header = f'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: {buffer.size}\r\n'
+    if seq is not None:
+        header += f'X-Frame-Seq: {seq}\r\n'
+    return b''.join((header.encode('ascii'), b'\r\n', buffer, b'\r\n'))
 
 @app.route('/video_feed')
 def video_feed():
@@ -318,39 +804,22 @@ def video_feed():
     if not LIBS_OK:
         return Response("", status=503)
     def generate():
-        global camera, face_mesh_instance
-        if camera is None:
-            camera = cv2.VideoCapture(0)
-            init_face_mesh()
-
-        while True:
-            ret, frame = camera.read()
-            if not ret:
+        ensure_video_camera()
+        while camera is not None:
+            slot, landmarks = read_video_frame()
+            if slot is None:
+                # 空きスロットがない（他の視聴者が使用中）か取得失敗。ロックを即座に奪い合わないよう少し待つ
+                time.sleep(STREAM_RETRY_INTERVAL)
+                continue
+            buffer, seq = encode_video_frame(slot, landmarks)
+            if buffer is None:
                 continue
-
-            # 元のモジュールの関数を使用
-            landmarks = extract_landmarks(frame, face_mesh_instance)
-            if landmarks is not None:
-                frame = draw_landmarks(frame, landmarks)
-            
-            # ガイド描画
-            h, w = frame.shape[:2]
-            overlay = frame.copy()
-            center = (w//2, h//2)
-            axes = (w//4, h//3)
-            cv2.ellipse(overlay, center, axes, 0, 0, 360, (0, 255, 255), -1)
-            alpha = 0.3
-            cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-            cv2.ellipse(frame, center, axes, 0, 0, 360, (0, 200, 200), 2)
-            
-            # フレームをJPEG形式でエンコード
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame = buffer.tobytes()
             
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+            yield mjpeg_part(buffer, seq)
     
-    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.headers['X-Frame-Seq-Scope'] = FRAME_SEQ_SCOPE_SHARED
+    return response
 
 if __name__ == '__main__':
-    app.run(debug=True, threaded=True)
\ No newline at end of file
+    app.run(debug=True, threaded=True)
@@ -0,0 +1,360 @@
+"""ASGI（非同期）配信モード
+
+    uvicorn asgi:app
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+アップロード・ストリーミング・結果取得をイベントループで処理し、
+CPU負荷の高い推論/エンコードはスレッドプールに逃がす。
+結果の更新待ち（/get_results?wait= のロングポーリングと /results/stream の SSE）は
+接続を長時間保持するため、このモードでのみ提供する。
+推論待ちが上限に達した場合は 429（Retry-After 付き）を返して負荷を落とす。
+それ以外のルート（ページ・静的ファイル等）は既存の Flask アプリに委譲する。
+"""
+import asyncio
+import contextlib
+import functools
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as core
+from result_store import format_sse, sse_event_id
+
+# ===== 非同期配信設定 =====
+INFERENCE_WORKERS = 2        # 推論用スレッド数
+INFERENCE_QUEUE_LIMIT = 8    # 実行中+待機中の推論の上限（超えたら 429）
+RETRY_AFTER_SECONDS = 2      # 429 応答の Retry-After
+MAX_STREAM_VIEWERS = 500     # /video_feed の同時視聴者数の上限
+LONG_POLL_MAX_WAIT = 30      # /get_results?wait= の最大待機秒数
+SSE_HEARTBEAT_SECONDS = 15   # /results/stream のキープアライブ間隔
+
+BUSY_MESSAGE = "混雑しています。しばらくしてから再度お試しください"
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+# ストリームは1本の生成ループを全視聴者で共有するため専用スレッド1本で足りる
+stream_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stream")
+
+
+class InferenceQueueFull(Exception):
+    pass
+
+
+class InferenceQueue:
+    """推論の同時実行数を制限し、満杯なら待たせずに拒否する"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.pending = 0
+
+    async def run(self, func, *args):
+        # イベントループ上でのみ増減するためロックは不要
+        if self.pending >= self.limit:
+            raise InferenceQueueFull()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(inference_executor, functools.partial(func, *args))
+        finally:
+            self.pending -= 1
+
+
+inference_queue = InferenceQueue(INFERENCE_QUEUE_LIMIT)
+
+
+class FrameBroadcaster:
+    """カメラ1台分のフレームを生成し、全視聴者へ最新フレームを配信する
+
+    視聴者ごとにカメラ読み込みや推論を行わないため、視聴者数が増えても
+    スレッド数は増えない。遅い視聴者は途中のフレームを読み飛ばす。
+    """
+    def __init__(self):
+        self.frame = None
+        self.seq = 0
+        self.viewers = 0
+        self._cond = asyncio.Condition()
+        self._task = None
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._produce())
+
+    async def _produce(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(stream_executor, core.ensure_video_camera)
+            while self.viewers > 0 and core.camera is not None:
+                part = await loop.run_in_executor(stream_executor, _render_stream_frame)
+                if part is None:
+                    await asyncio.sleep(core.STREAM_RETRY_INTERVAL)
+                    continue
+                async with self._cond:
+                    self.frame = part
+                    self.seq += 1
+                    self._cond.notify_all()
+        finally:
+            # 視聴者の待機を解除して終了を知らせる
+            async with self._cond:
+                self._cond.notify_all()
+
+    async def frames(self):
+        """新しいフレームが生成されるたびに multipart の1パートを返す（全視聴者で同じオブジェクト）"""
+        self.viewers += 1
+        self._ensure_running()
+        task = self._task
+        last_seq = self.seq
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: self.seq != last_seq or task.done())
+                    if self.seq == last_seq:
+                        return
+                    last_seq = self.seq
+                    frame = self.frame
+                yield frame
+        finally:
+            self.viewers -= 1
+
+
+broadcaster = FrameBroadcaster()
+
+
+def _render_stream_frame():
+    slot, landmarks = core.read_video_frame()
+    if slot is None:
+        return None
+    buffer, seq = core.encode_video_frame(slot, landmarks)
+    if buffer is None:
+        return None
+    return core.mjpeg_part(buffer, seq)
+
+
+def _decode_and_process(process, data):
+    """アップロード画像をデコードして処理関数に渡す（推論スレッドで実行）"""
+    img = core.decode_image_bytes(data)
+    if img is None:
+        return {"success": False, "error": "画像の読み込みに失敗しました"}, 400
+    return process(img)
+
+
+def _libs_error(key="error"):
+    return JSONResponse({"success": False, key: f"依存ライブラリの読み込みに失敗しました: {core._import_error_message}"},
+                        status_code=500)
+
+
+def _busy(key="error"):
+    return JSONResponse({"success": False, key: BUSY_MESSAGE}, status_code=429,
+                        headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+async def _read_upload(request, required=True):
+    """フォームの image を読み込み (data, error_message) を返す"""
+    form = await request.form()
+    file = form.get("image")
+    if file is None or isinstance(file, str):
+        return None, ("画像ファイルがありません" if required else None)
+    if file.filename == "":
+        return None, "ファイル名が不正です"
+    return await file.read(), None
+
+
+async def _json_options(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+async def upload_base(request):
+    if not core.LIBS_OK:
+        return _libs_error()
+    data, error = await _read_upload(request)
+    if error:
+        return JSONResponse({"success": False, "error": error}, status_code=400)
+    try:
+        payload, status = await inference_queue.run(_decode_and_process, core.process_base_image, data)
+    except InferenceQueueFull:
+        return _busy()
+    return JSONResponse(payload, status_code=status)
+
+
+async def compare(request):
+    if not core.LIBS_OK:
+        return _libs_error()
+    data, error = await _read_upload(request, required=False)
+    # 画像なしでカメラ稼働中ならカメラ比較として扱う
+    if data is None and error is None and core.camera is not None:
+        return await compare_camera(request)
+    if not os.path.exists(core.PAST_IMAGE_PATH):
+        return JSONResponse({"success": False, "error": "先に基準画像をアップロードしてください"})
+    if data is None:
+        return JSONResponse({"success": False, "error": error or "画像ファイルがありません"}, status_code=400)
+    try:
+        payload, status = await inference_queue.run(_decode_and_process, core.process_compare_image, data)
+    except InferenceQueueFull:
+        return _busy()
+    return JSONResponse(payload, status_code=status)
+
+
+async def capture(request):
+    options = await _json_options(request)
+    try:
+        result = await inference_queue.run(core.capture_current_frame, options)
+    except InferenceQueueFull:
+        return _busy("message")
+    return JSONResponse(result)
+
+
+async def compare_camera(request):
+    options = await _json_options(request)
+    try:
+        result = await inference_queue.run(core.compare_current_frame, options)
+    except InferenceQueueFull:
+        return _busy("message")
+    return JSONResponse(result)
+
+
+async def _multi(request, process):
+    if not core.LIBS_OK:
+        return _libs_error()
+    data, error = await _read_upload(request, required=False)
+    if error:
+        return JSONResponse({"success": False, "error": error}, status_code=400)
+    try:
+        if data is None:
+            payload, status = await inference_queue.run(process)
+        else:
+            payload, status = await inference_queue.run(_decode_and_process, process, data)
+    except InferenceQueueFull:
+        return _busy()
+    return JSONResponse(payload, status_code=status)
+
+
+async def multi_capture(request):
+    return await _multi(request, core.process_multi_capture)
+
+
+async def multi_compare(request):
+    return await _multi(request, core.process_multi_compare)
+
+
+class ResultNotifier:
+    """ResultStore の更新（任意のスレッド）をイベントループ上の待機者へ中継する"""
+    def __init__(self):
+        self._loop = None
+        self._event = asyncio.Event()
+
+    def attach(self, loop):
+        self._loop = loop
+        core.result_store.add_listener(self._on_update)
+
+    def detach(self):
+        core.result_store.remove_listener(self._on_update)
+
+    def _on_update(self, version):
+        self._loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self):
+        # 待機中の全員を起こし、次の更新用に新しいイベントへ差し替える
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_for_change(self, version, timeout):
+        """version から更新されるまで最大 timeout 秒待つ。更新されたら True"""
+        while core.result_store.version == version:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+result_notifier = ResultNotifier()
+
+
+async def get_results(request):
+    """結果取得API（ETag / 304 / ?wait= によるロングポーリング対応）"""
+    store = core.result_store
+    known_version = store.version_for_etag(request.headers.get('if-none-match'))
+    if known_version is not None:
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            wait = 0
+        # nan / inf は上限で丸められないため待たずに 304 を返す
+        wait = min(wait, LONG_POLL_MAX_WAIT) if math.isfinite(wait) else 0
+        if wait <= 0 or not await result_notifier.wait_for_change(known_version, wait):
+            _, etag, _ = store.snapshot()
+            return Response(status_code=304, headers={'ETag': etag})
+    version, etag, body = store.snapshot()
+    return Response(body, media_type='application/json', headers={
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'X-Results-Version': str(version),
+    })
+
+
+async def results_stream(request):
+    """結果更新のプッシュ通知（Server-Sent Events）"""
+    store = core.result_store
+    last_event_id = request.headers.get('last-event-id', '')
+
+    async def generate():
+        version, etag, body = store.snapshot()
+        # 再接続時、既に受け取っているバージョンなら再送しない
+        if last_event_id != sse_event_id(etag):
+            yield format_sse(sse_event_id(etag), body)
+        while True:
+            if await result_notifier.wait_for_change(version, SSE_HEARTBEAT_SECONDS):
+                version, etag, body = store.snapshot()
+                yield format_sse(sse_event_id(etag), body)
+            else:
+                yield b": keepalive\n\n"
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def video_feed(request):
+    if not core.LIBS_OK:
+        return Response("", status_code=503)
+    if broadcaster.viewers >= MAX_STREAM_VIEWERS:
+        return _busy("message")
+
+    return StreamingResponse(broadcaster.frames(), media_type='multipart/x-mixed-replace; boundary=frame',
+                             headers={'X-Frame-Seq-Scope': core.FRAME_SEQ_SCOPE_BROADCAST})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    result_notifier.attach(asyncio.get_running_loop())
+    yield
+    result_notifier.detach()
+    inference_executor.shutdown(wait=False)
+    stream_executor.shutdown(wait=False)
+    if core.video_pipeline is not None:
+        core.video_pipeline.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/upload_base', upload_base, methods=['POST']),
+        Route('/compare', compare, methods=['POST']),
+        Route('/capture', capture, methods=['POST']),
+        Route('/multi/capture', multi_capture, methods=['POST']),
+        Route('/multi/compare', multi_compare, methods=['POST']),
+        Route('/get_results', get_results),
+        Route('/results/stream', results_stream),
+        Route('/video_feed', video_feed),
+        # 上記以外は既存の Flask アプリで処理
+        Mount('/', app=WSGIMiddleware(core.app)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app)
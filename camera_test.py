@@ -1,6 +1,8 @@
 import cv2
 import sys
 
+from frame_source import open_frame_source
+
 def test_camera():
     print("カメラテストを開始します...")
     
@@ -42,7 +44,36 @@ def check_opencv_backends():
     backends = cv2.videoio_registry.getCameraBackends()
     print(f"利用可能なカメラバックエンド: {backends}")
 
+def test_frame_source(spec, frames=30):
+    """カメラ以外のフレームソース（file: / images: / synthetic:）を確認"""
+    print(f"フレームソース {spec} をテスト中...")
+    source = open_frame_source(spec)
+    if not source.isOpened():
+        print("❌ フレームソースを開けませんでした")
+        return False
+
+    import time
+    start = time.monotonic()
+    ok = 0
+    for _ in range(frames):
+        ret, frame = source.read()
+        if ret:
+            ok += 1
+    elapsed = time.monotonic() - start
+    source.release()
+
+    if ok == 0:
+        print("❌ フレームを取得できませんでした")
+        return False
+    height, width = frame.shape[:2]
+    print(f"✅ {ok}/{frames} フレーム取得  解像度: {width}x{height}  実効FPS: {ok / elapsed:.1f}")
+    return True
+
 if __name__ == "__main__":
+    # 引数でフレームソースを指定した場合はそれを確認（例: synthetic:1280x720@30）
+    if len(sys.argv) > 1:
+        sys.exit(0 if test_frame_source(sys.argv[1]) else 1)
+
     check_opencv_backends()
     camera_index = test_camera()
     
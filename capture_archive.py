@@ -0,0 +1,156 @@
+import contextlib
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# ===== 撮影アーカイブ設定 =====
+ARCHIVE_MAX_AGE_DAYS = 30              # これより古い撮影は削除
+ARCHIVE_MAX_BYTES = 500 * 1024 * 1024  # 合計サイズの上限（超えたら古い順に削除）
+ARCHIVE_JPEG_QUALITY = None            # 保存時の JPEG 品質。None は cv2 の既定値（従来の imwrite と同じ）
+ARCHIVE_THUMBNAIL_SIZE = 240           # サムネイルの長辺（ピクセル）
+RETENTION_INTERVAL = 300               # 保持期間チェックの最短間隔（秒）
+
+# "{timestamp}_{種類}_{ハッシュ}" 形式。内容が変わればURLも変わるため長期キャッシュできる
+_HASHED_NAME_RE = re.compile(r"^\d{8}_\d{6}_[a-z_]+_[0-9a-f]{12}(_thumb)?\.(jpg|npy)$")
+# 保持期間の管理対象（同じタイムスタンプのファイルは1件の撮影としてまとめて扱う）
+_GROUP_RE = re.compile(r"^(\d{8}_\d{6})_")
+
+PAST_LANDMARKS_NAME = "past_landmarks.npy"
+
+
+def is_immutable_name(filename):
+    """コンテンツハッシュ付きのファイル名か"""
+    return bool(_HASHED_NAME_RE.match(os.path.basename(filename)))
+
+
+class CaptureArchive:
+    """撮影画像・ランドマークの保存と保持期間の管理"""
+    def __init__(self, directory, max_age_days=ARCHIVE_MAX_AGE_DAYS,
+                 max_bytes=ARCHIVE_MAX_BYTES, jpeg_quality=ARCHIVE_JPEG_QUALITY,
+                 thumbnail_size=ARCHIVE_THUMBNAIL_SIZE):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.jpeg_quality = jpeg_quality
+        self.thumbnail_size = thumbnail_size
+        self._last_retention = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, name, data):
+        """一時ファイル経由で書き込み、読み込み途中のファイルを配信しない"""
+        return self._atomic_write(name, lambda f: f.write(data))
+
+    def _atomic_write(self, name, write):
+        # 一時ファイル名は書き込みごとに一意にする（複数ワーカーが同じファイルを同時に更新しても衝突しない）。
+        # 先頭の "." で保持期間管理の対象外にする
+        path = os.path.join(self.directory, name)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def _encode(self, image, quality=None):
+        quality = quality or self.jpeg_quality
+        params = [] if quality is None else [cv2.IMWRITE_JPEG_QUALITY, quality]
+        ok, buffer = cv2.imencode(".jpg", image, params)
+        if not ok:
+            raise ValueError("JPEG エンコードに失敗しました")
+        return buffer
+
+    def store_image(self, timestamp, kind, image, landmarks=None, thumbnail=False):
+        """画像をコンテンツハッシュ付きの名前で保存し、保存したファイル名の辞書を返す
+
+        landmarks を渡すと同名の .npy（float32）を、thumbnail=True ならサムネイルも保存する。
+        """
+        buffer = self._encode(image)
+        digest = hashlib.sha256(buffer).hexdigest()[:12]
+        stem = f"{timestamp}_{kind}_{digest}"
+
+        names = {"image": f"{stem}.jpg"}
+        self._write(names["image"], buffer)
+
+        if landmarks is not None:
+            names["landmarks"] = f"{stem}.npy"
+            self._write_landmarks(names["landmarks"], landmarks)
+
+        if thumbnail:
+            h, w = image.shape[:2]
+            scale = min(1.0, self.thumbnail_size / max(h, w))
+            thumb = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+            names["thumbnail"] = f"{stem}_thumb.jpg"
+            self._write(names["thumbnail"], self._encode(thumb, quality=80))
+
+        self.maybe_apply_retention()
+        return names
+
+    def _write_landmarks(self, name, landmarks):
+        self._atomic_write(name, lambda f: np.save(f, np.asarray(landmarks, dtype=np.float32)))
+
+    def load_landmarks(self, name):
+        """保存済みランドマークを読み込む（存在しなければ None）"""
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        return np.load(path)
+
+    def set_past(self, past_image_path, image, landmarks):
+        """基準画像とそのランドマークを更新"""
+        self._write(os.path.basename(past_image_path), self._encode(image))
+        self._write_landmarks(PAST_LANDMARKS_NAME, landmarks)
+
+    def load_past_landmarks(self, past_image_path):
+        """基準画像より新しいランドマークファイルがあれば読み込む"""
+        lm_path = os.path.join(self.directory, PAST_LANDMARKS_NAME)
+        if not os.path.exists(lm_path) or not os.path.exists(past_image_path):
+            return None
+        if os.path.getmtime(lm_path) < os.path.getmtime(past_image_path):
+            return None
+        return np.load(lm_path)
+
+    def maybe_apply_retention(self):
+        now = time.monotonic()
+        if now - self._last_retention >= RETENTION_INTERVAL:
+            self._last_retention = now
+            self.apply_retention()
+
+    def apply_retention(self):
+        """期限切れ・容量超過の撮影を古い順に削除し、削除したファイル数を返す"""
+        groups = {}
+        for entry in os.scandir(self.directory):
+            match = _GROUP_RE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            stat = entry.stat()
+            group = groups.setdefault(match.group(1), {"files": [], "size": 0, "mtime": 0.0})
+            group["files"].append(entry.path)
+            group["size"] += stat.st_size
+            group["mtime"] = max(group["mtime"], stat.st_mtime)
+
+        ordered = sorted(groups.values(), key=lambda g: g["mtime"])
+        total = sum(g["size"] for g in ordered)
+        cutoff = time.time() - self.max_age_days * 86400
+
+        removed = 0
+        for group in ordered:
+            if group["mtime"] >= cutoff and total <= self.max_bytes:
+                break
+            for path in group["files"]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+            total -= group["size"]
+        return removed
@@ -59,72 +59,124 @@ LANDMARK_POINTS = {
     }
 }
 
+# ===== 特徴記述ルール =====
+# 変化量の区分（|変化率| < 5: わずかに, < 10: やや, それ以上: 顕著に）
+MAGNITUDE_BINS = np.array([5.0, 10.0])
+MAGNITUDE_WORDS = ["わずかに", "やや", "顕著に"]
+# これを超える変化は数値も表示
+SHOW_PERCENT_ABOVE = 10
+
+# 特徴ごとの表現ルール: (増加時, 減少時, 変化なしを増加側として扱うか)
+FEATURE_RULES = {
+    "左目の幅": ("大きくなっています", "小さくなっています", False),
+    "左目の高さ": ("高くなっています", "低くなっています", False),
+    "右目の幅": ("大きくなっています", "小さくなっています", False),
+    "右目の高さ": ("高くなっています", "低くなっています", False),
+    "両目間の距離": ("広がっています", "狭まっています", False),
+    "鼻の幅": ("長くなっています", "短くなっています", False),
+    "口の幅": ("横に広がっています", "横幅が狭まっています", False),
+    "輪郭": ("丸みを帯びています", "シャープになっています", True),
+    "顔の幅": ("大きくなっています", "小さくなっています", False),
+}
+DEFAULT_FEATURE_RULE = ("変化があります", "変化があります", False)
+
+# 総合的な洞察: (対象の特徴, 符号, 文言)。対象が全て同じ符号で変化したときに追加
+INSIGHT_RULES = [
+    (("顔の幅", "輪郭"), 1, "全体的に顔がふっくらしており、むくみが目立ちます。"),
+    (("顔の幅", "輪郭"), -1, "顔全体がすっきりしてシャープになっています。"),
+]
+NO_CHANGE_MESSAGE = "顔の特徴に顕著な変化は見られませんでした。"
+
+
 class FaceFeatureAnalyzer:
-    """顔特徴分析クラス"""
-    def __init__(self):
-        pass
+    """顔特徴分析クラス
+
+    ルール表は特徴名の並びごとに一度だけコンパイルし、全インスタンスで共有する。
+    """
+    _compiled = {}
+
+    def _compile(self, feature_names):
+        """特徴名の並びに対する (文言表 (M, 区分数, 2), 変化なし=増加 (M,), 洞察) を返す"""
+        key = tuple(feature_names)
+        table = self._compiled.get(key)
+        if table is None:
+            phrases = np.empty((len(key), len(MAGNITUDE_WORDS), 2), dtype=object)
+            zero_is_increase = np.zeros(len(key), dtype=bool)
+            for j, feature in enumerate(key):
+                increase, decrease, zero_inc = FEATURE_RULES.get(feature, DEFAULT_FEATURE_RULE)
+                zero_is_increase[j] = zero_inc
+                for k, magnitude in enumerate(MAGNITUDE_WORDS):
+                    phrases[j, k, 0] = f"{feature}が{magnitude}{decrease}"
+                    phrases[j, k, 1] = f"{feature}が{magnitude}{increase}"
+            insights = [
+                (np.array([key.index(f) for f in features]), sign, text)
+                for features, sign, text in INSIGHT_RULES
+                if all(f in key for f in features)
+            ]
+            table = (phrases, zero_is_increase, insights)
+            self._compiled[key] = table
+        return table
+
+    def generate_batch(self, change_percents, feature_names=None):
+        """(N, M) の変化率配列から N 件分の記述リストを一括生成"""
+        feature_names = FEATURE_NAMES if feature_names is None else feature_names
+        pct = np.asarray(change_percents, dtype=np.float64)
+        if pct.ndim == 1:
+            pct = pct[None, :]
+        phrases, zero_is_increase, insights = self._compile(feature_names)
+
+        # 区分・向き・数値表示・洞察をまとめて判定
+        abs_pct = np.abs(pct)
+        magnitude = np.digitize(abs_pct, MAGNITUDE_BINS)
+        increase = np.where(zero_is_increase, ~(pct < 0), pct > 0)
+        texts = phrases[np.arange(len(feature_names)), magnitude, increase.astype(int)]
+        show_percent = abs_pct > SHOW_PERCENT_ABOVE
+        insight_hits = [
+            (np.all(pct[:, cols] > 0 if sign > 0 else pct[:, cols] < 0, axis=1), text)
+            for cols, sign, text in insights
+        ]
+
+        results = []
+        for i in range(len(pct)):
+            descriptions = texts[i].tolist()
+            for j in np.flatnonzero(show_percent[i]):
+                descriptions[j] += f"（{pct[i, j]:+.1f}%）"
+            if not descriptions:
+                descriptions.append(NO_CHANGE_MESSAGE)
+            for hits, text in insight_hits:
+                if hits[i]:
+                    descriptions.append(text)
+            results.append(descriptions)
+        return results
+
+    def generate_descriptions_batch(self, changes_list):
+        """calculate_differences の結果のリストから記述リストを一括生成"""
+        if not changes_list:
+            return []
+        names = self._valid_features(changes_list[0])
+        if any(self._valid_features(changes) != names for changes in changes_list):
+            # 特徴の並びが揃っていない場合は1件ずつ処理
+            return [self.generate_feature_descriptions(changes) for changes in changes_list]
+        pct = np.array([[changes[f]["change_percent"] for f in names] for changes in changes_list],
+                       dtype=np.float64).reshape(len(changes_list), len(names))
+        return self.generate_batch(pct, names)
+
+    @staticmethod
+    def _valid_features(changes):
+        return [f for f, data in changes.items() if isinstance(data, dict) and "change_percent" in data]
 
     def generate_feature_descriptions(self, changes):
         """特徴変化の自然言語記述生成（輪郭・むくみ・対称性にも対応）"""
-        descriptions = []
-
-        for feature, data in changes.items():
-            if isinstance(data, dict) and "change_percent" in data:
-                change_percent = data["change_percent"]
-                abs_percent = abs(change_percent)
-
-                # 変化量に応じた表現
-                if abs_percent < 5:
-                    magnitude = "わずかに"
-                elif abs_percent < 10:
-                    magnitude = "やや"
-                else:
-                    magnitude = "顕著に"
-
-                # 各特徴ごとの表現ルール
-                if feature == "左目の幅":
-                    direction = "大きくなっています" if change_percent > 0 else "小さくなっています"
-                elif feature == "左目の高さ":
-                    direction = "高くなっています" if change_percent > 0 else "低くなっています"
-                elif feature == "右目の幅":
-                    direction = "大きくなっています" if change_percent > 0 else "小さくなっています"
-                elif feature == "右目の高さ":
-                    direction = "高くなっています" if change_percent > 0 else "低くなっています"
-                elif feature == "両目間の距離":
-                    direction = "広がっています" if change_percent > 0 else "狭まっています"
-                elif feature == "鼻の幅":
-                    direction = "長くなっています" if change_percent > 0 else "短くなっています"
-                elif feature == "口の幅":
-                    direction = "横に広がっています" if change_percent > 0 else "横幅が狭まっています"
-                elif feature == "輪郭":
-                    direction = "シャープになっています" if change_percent < 0 else "丸みを帯びています"
-                elif feature == "顔の幅":
-                    direction = "大きくなっています" if change_percent > 0 else "小さくなっています"
-                else:
-                    direction = "変化があります"
-
-                description = f"{feature}が{magnitude}{direction}"
-
-                # 大きめの変化は数値を表示
-                if abs_percent > 10:
-                    description += f"（{change_percent:+.1f}%）"
-
-                descriptions.append(description)
-
-        if not descriptions:
-            descriptions.append("顔の特徴に顕著な変化は見られませんでした。")
-
-        # 総合的な洞察を追加
-        self.add_insights(descriptions, changes)
-        return descriptions
+        return self.generate_descriptions_batch([changes])[0]
 
     def add_insights(self, descriptions, changes):
         """変化の洞察を追加"""
-        if "輪郭" in changes and "顔の幅" in changes:
-            if changes["顔の幅"]["change_percent"] > 0 and changes["輪郭"]["change_percent"] > 0:
-                descriptions.append("全体的に顔がふっくらしており、むくみが目立ちます。")
-            elif changes["顔の幅"]["change_percent"] < 0 and changes["輪郭"]["change_percent"] < 0:
-                descriptions.append("顔全体がすっきりしてシャープになっています。")
+        for features, sign, text in INSIGHT_RULES:
+            if all(f in changes for f in features):
+                values = [changes[f]["change_percent"] for f in features]
+                if all((v > 0) if sign > 0 else (v < 0) for v in values):
+                    descriptions.append(text)
+                    break
 
 # フォント設定関数
 def setup_japanese_font():
@@ -175,9 +227,13 @@ def draw_japanese_text(img, text, position, font, color=(255, 255, 255)):
 # ランドマーク抽出関数
 def extract_landmarks(image, face_mesh):
     rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return extract_landmarks_rgb(rgb_image, face_mesh)
+
+# RGB画像からのランドマーク抽出（変換済みバッファを再利用する場合に使用）
+def extract_landmarks_rgb(rgb_image, face_mesh):
     results = face_mesh.process(rgb_image)
     if results.multi_face_landmarks:
-        h, w = image.shape[:2]
+        h, w = rgb_image.shape[:2]
         points = []
         for lm in results.multi_face_landmarks[0].landmark:
             x = int(lm.x * w)
@@ -186,6 +242,17 @@ def extract_landmarks(image, face_mesh):
         return np.array(points)
     return None
 
+# 複数顔のランドマーク抽出（(F, 478, 2) の配列を返す）
+def extract_all_landmarks(image, face_mesh):
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    results = face_mesh.process(rgb_image)
+    if results.multi_face_landmarks:
+        h, w = image.shape[:2]
+        coords = np.array([[(lm.x, lm.y) for lm in face.landmark]
+                           for face in results.multi_face_landmarks])
+        return (coords * (w, h)).astype(int)
+    return None
+
 # 目の中心を計算する関数
 def calculate_eye_center(landmarks, eye_points):
     """目のランドマークから中心座標を計算"""
@@ -193,8 +260,8 @@ def calculate_eye_center(landmarks, eye_points):
     return np.mean(eye_coords, axis=0).astype(int)
 
 # ランドマーク描画
-def draw_landmarks(image, landmarks):
-    img = image.copy()
+def draw_landmarks(image, landmarks, inplace=False):
+    img = image if inplace else image.copy()
     
     # 左目（緑）
     for point in LANDMARK_POINTS['LEFT_EYE']:
@@ -228,83 +295,59 @@ def draw_landmarks(image, landmarks):
     return img
 
 # ===== 差異計算関数 =====
+# 特徴量の定義（名前, 端点A, 端点B）。特徴量は2点間の距離
+_KP = LANDMARK_POINTS['KEY_POINTS']
+FEATURE_METRICS = [
+    ('左目の幅', _KP['left_eye_left'], _KP['left_eye_right']),
+    ('右目の幅', _KP['right_eye_left'], _KP['right_eye_right']),
+    ('両目間の距離', _KP['left_eye_right'], _KP['right_eye_left']),
+    ('鼻の幅', _KP['nose_left'], _KP['nose_right']),
+    ('口の幅', _KP['mouth_left'], _KP['mouth_right']),
+    ('顔の幅', _KP['face_left'], _KP['face_right']),
+    ('顔の高さ', _KP['forehead'], _KP['chin']),
+    ('左目の高さ', 159, 145),  # 左目上部 - 左目下部
+    ('右目の高さ', 386, 374),  # 右目上部 - 右目下部
+]
+FEATURE_NAMES = [name for name, _, _ in FEATURE_METRICS]
+_METRIC_A = np.array([a for _, a, _ in FEATURE_METRICS])
+_METRIC_B = np.array([b for _, _, b in FEATURE_METRICS])
+
+
+def compute_feature_metrics(landmarks):
+    """ランドマークから特徴量（距離）を一括計算
+
+    (478, 2) なら (M,)、(F, 478, 2) なら (F, M) の配列を返す。
+    """
+    landmarks = np.asarray(landmarks)
+    return np.linalg.norm(landmarks[..., _METRIC_A, :] - landmarks[..., _METRIC_B, :], axis=-1)
+
+
+def calculate_difference_arrays(lm_past, lm_current):
+    """特徴量の変化を配列のまま返す (pixel_change, change_percent)"""
+    past = compute_feature_metrics(lm_past)
+    current = compute_feature_metrics(lm_current)
+    pixel_change = current - past
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_percent = np.where(past != 0, pixel_change / past * 100, 0.0)
+    return pixel_change, change_percent
+
+
+def _difference_dict(pixel_change, change_percent):
+    return {
+        name: {"pixel_change": float(px), "change_percent": float(pct)}
+        for name, px, pct in zip(FEATURE_NAMES, pixel_change, change_percent)
+    }
+
+
 def calculate_differences(lm_past, lm_current):
-    diffs = {}
-    key_points = LANDMARK_POINTS['KEY_POINTS']
-    
-    # 左目の幅
-    left_eye_width_past = np.linalg.norm(lm_past[key_points['left_eye_left']] - lm_past[key_points['left_eye_right']])
-    left_eye_width_current = np.linalg.norm(lm_current[key_points['left_eye_left']] - lm_current[key_points['left_eye_right']])
-    pixel_change = left_eye_width_current - left_eye_width_past
-    change_percent = (pixel_change / left_eye_width_past) * 100 if left_eye_width_past != 0 else 0
-    diffs['左目の幅'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-    # 右目の幅
-    right_eye_width_past = np.linalg.norm(lm_past[key_points['right_eye_left']] - lm_past[key_points['right_eye_right']])
-    right_eye_width_current = np.linalg.norm(lm_current[key_points['right_eye_left']] - lm_current[key_points['right_eye_right']])
-    pixel_change = right_eye_width_current - right_eye_width_past
-    change_percent = (pixel_change / right_eye_width_past) * 100 if right_eye_width_past != 0 else 0
-    diffs['右目の幅'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    # 両目間の距離
-    eye_distance_past = np.linalg.norm(lm_past[key_points['left_eye_right']] - lm_past[key_points['right_eye_left']])
-    eye_distance_current = np.linalg.norm(lm_current[key_points['left_eye_right']] - lm_current[key_points['right_eye_left']])
-    pixel_change = eye_distance_current - eye_distance_past
-    change_percent = (pixel_change / eye_distance_past) * 100 if eye_distance_past != 0 else 0
-    diffs['両目間の距離'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-    # 鼻の幅
-    nose_width_past = np.linalg.norm(lm_past[key_points['nose_left']] - lm_past[key_points['nose_right']])
-    nose_width_current = np.linalg.norm(lm_current[key_points['nose_left']] - lm_current[key_points['nose_right']])
-    pixel_change = nose_width_current - nose_width_past 
-    change_percent = (pixel_change / nose_width_past ) * 100 if nose_width_past != 0 else 0
-    diffs['鼻の幅'] = {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    # 口の幅
-    mouth_width_past = np.linalg.norm(lm_past[key_points['mouth_left']] - lm_past[key_points['mouth_right']])
-    mouth_width_current = np.linalg.norm(lm_current[key_points['mouth_left']] - lm_current[key_points['mouth_right']])
-    pixel_change = mouth_width_current - mouth_width_past
-    change_percent = (pixel_change / mouth_width_past) * 100 if mouth_width_past != 0 else 0
-    diffs['口の幅'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    # 顔の幅
-    face_width_past = np.linalg.norm(lm_past[key_points['face_left']] - lm_past[key_points['face_right']])
-    face_width_current = np.linalg.norm(lm_current[key_points['face_left']] - lm_current[key_points['face_right']])
-    pixel_change = face_width_current - face_width_past
-    change_percent = (pixel_change / face_width_past) * 100 if face_width_past != 0 else 0
-    diffs['顔の幅'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    # 顔の高さ（額から顎まで）
-    face_height_past = np.linalg.norm(lm_past[key_points['forehead']] - lm_past[key_points['chin']])
-    face_height_current = np.linalg.norm(lm_current[key_points['forehead']] - lm_current[key_points['chin']])
-    pixel_change = face_height_current - face_height_past
-    change_percent = (pixel_change / face_height_past) * 100 if face_height_past != 0 else 0
-    diffs['顔の高さ'] =  {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    # 左目の高さ（上下の幅）
-    left_eye_top = lm_past[159]  # 左目上部
-    left_eye_bottom = lm_past[145]  # 左目下部
-    left_eye_height_past = np.linalg.norm(left_eye_top - left_eye_bottom)
-    
-    left_eye_top = lm_current[159]
-    left_eye_bottom = lm_current[145]
-    left_eye_height_current = np.linalg.norm(left_eye_top - left_eye_bottom)
-    pixel_change = left_eye_height_current - left_eye_height_past
-    change_percent = (pixel_change / left_eye_height_past) * 100 if left_eye_height_past != 0 else 0
-    diffs['左目の高さ'] = {"pixel_change": pixel_change,"change_percent": change_percent}
-
-
-    # 右目の高さ
-    right_eye_top = lm_past[386]  # 右目上部
-    right_eye_bottom = lm_past[374]  # 右目下部
-    right_eye_height_past = np.linalg.norm(right_eye_top - right_eye_bottom)
-    
-    right_eye_top = lm_current[386]
-    right_eye_bottom = lm_current[374]
-    right_eye_height_current = np.linalg.norm(right_eye_top - right_eye_bottom)
-    pixel_change = right_eye_height_current - right_eye_height_past
-    change_percent = (pixel_change / right_eye_height_past) * 100 if right_eye_height_past != 0 else 0
-    diffs['右目の高さ'] = {"pixel_change": pixel_change,"change_percent": change_percent}
-
-    return diffs
+    pixel_change, change_percent = calculate_difference_arrays(lm_past, lm_current)
+    return _difference_dict(pixel_change, change_percent)
+
+
+def calculate_differences_batch(lm_past, lm_current):
+    """(F, 478, 2) 同士の差異を一括計算し、顔ごとの差異辞書のリストを返す"""
+    pixel_change, change_percent = calculate_difference_arrays(lm_past, lm_current)
+    return [_difference_dict(px, pct) for px, pct in zip(pixel_change, change_percent)]
     
 # ================== 撮影処理 ==================
 def capture_image(frame, landmarks):
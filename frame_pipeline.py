@@ -0,0 +1,264 @@
+import contextlib
+import threading
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from face_compare_heatmap import draw_landmarks, extract_landmarks_rgb
+
+# ===== フレームパイプライン設定 =====
+RING_SLOTS = 4                 # 事前確保するフレームバッファ数
+JPEG_QUALITY = 95              # ストリーム配信時の JPEG 品質（OpenCV 既定値と同じ）
+GUIDE_COLOR = (0, 255, 255)    # ガイド（塗りつぶし）の色
+GUIDE_EDGE_COLOR = (0, 200, 200)
+GUIDE_ALPHA = 0.3
+
+# 共有メモリ先頭の参照カウント領域（スロットごとに int32）。フレーム領域は64バイト境界から
+_HEADER_ALIGN = 64
+
+
+class FrameSlot:
+    """リング内の1フレーム分のバッファ（参照カウント付き）"""
+    def __init__(self, ring, index):
+        self.ring = ring
+        self.index = index
+        self.array = ring.frames[index]
+        # 取得元のフレーム通し番号（フレーム落ちの計測用）
+        self.seq = None
+
+    def retain(self):
+        """別のステージへ渡す前に参照を追加"""
+        self.ring._retain(self.index)
+        return self
+
+    def release(self):
+        """参照を1つ解放（0になるとスロットは再利用される）"""
+        self.ring._release(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """事前確保したフレームバッファのリング
+
+    shared=True の場合はバッファと参照カウントを共有メモリ上に置く（FrameRing.attach() で接続、
+    lock には multiprocessing.Lock を渡す）。アプリ本体は shared=False のみを使っており、
+    プロセス間での利用は自動テストで検証していない実験的な機能。
+    共有メモリは作成したリングが unlink するまで残るため、使い終えたら close() と unlink() を呼ぶ。
+    """
+    def __init__(self, shape, slots=RING_SLOTS, dtype=np.uint8, shared=False, lock=None,
+                 name=None, _create=True):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self._lock = lock or threading.Lock()
+        self._next = 0
+        self.dropped = 0
+        self._owner = _create
+
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        header = -(-slots * 4 // _HEADER_ALIGN) * _HEADER_ALIGN
+        self._shm = None
+        if shared:
+            if _create:
+                self._shm = shared_memory.SharedMemory(create=True, size=header + frame_bytes * slots, name=name)
+            else:
+                self._shm = shared_memory.SharedMemory(name=name)
+            buf = self._shm.buf
+        else:
+            buf = bytearray(header + frame_bytes * slots)
+
+        self._refs = np.ndarray((slots,), dtype=np.int32, buffer=buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=buf, offset=header)
+        if _create:
+            self._refs[:] = 0
+
+    @classmethod
+    def attach(cls, name, shape, slots=RING_SLOTS, dtype=np.uint8, lock=None):
+        """既存の共有メモリのリングに接続"""
+        return cls(shape, slots, dtype, shared=True, lock=lock, name=name, _create=False)
+
+    @property
+    def name(self):
+        return self._shm.name if self._shm else None
+
+    def acquire(self):
+        """空きスロットを確保（参照カウント1）。空きがなければ None（フレーム落ち）"""
+        with self._lock:
+            for i in range(self.slots):
+                index = (self._next + i) % self.slots
+                if self._refs[index] == 0:
+                    self._refs[index] = 1
+                    self._next = (index + 1) % self.slots
+                    return FrameSlot(self, index)
+            self.dropped += 1
+            return None
+
+    def _retain(self, index):
+        with self._lock:
+            self._refs[index] += 1
+
+    def _release(self, index):
+        with self._lock:
+            if self._refs is not None and self._refs[index] > 0:
+                self._refs[index] -= 1
+
+    def in_use(self):
+        """参照中のスロットがあるか（他プロセスでの参照も含む）"""
+        with self._lock:
+            return self._refs is not None and bool(self._refs.any())
+
+    def close(self):
+        if self._shm is not None and self._refs is not None:
+            # ndarray がバッファを参照したままだと close できないため先に外す
+            self._refs = None
+            self.frames = None
+            # 解放済みスロットの FrameSlot がまだ配列を保持している場合は、
+            # それらが破棄された時点でマッピングが解放される
+            with contextlib.suppress(BufferError):
+                self._shm.close()
+
+    def unlink(self):
+        if self._shm is not None and self._owner:
+            with contextlib.suppress(FileNotFoundError):
+                self._shm.unlink()
+            self._owner = False
+
+
+class FramePipeline:
+    """取得 → 推論 → 描画 → エンコードをリングのバッファ上でその場処理する
+
+    フレームごとの確保は JPEG エンコード結果とガイドの合成結果（楕円の外接矩形分）のみ。
+    RGB変換用バッファやガイドのマスクは解像度ごとに一度だけ確保する。
+    infer は共有のRGBバッファを使うため呼び出し側で直列化すること。
+    annotate / encode はスロットごとに独立しており、複数スレッドから同時に呼んでよい。
+    """
+    def __init__(self, slots=RING_SLOTS, shared=False, lock=None):
+        self.slots = slots
+        self.shared = shared
+        self.lock = lock
+        self.ring = None
+        # 解像度変更で差し替えた古いリング（使用中のスロットがなくなったら破棄する）
+        self._retired = []
+        self._rgb = None
+        self._guide = None
+        self._setup_lock = threading.Lock()
+
+    @property
+    def dropped(self):
+        return self.ring.dropped if self.ring else 0
+
+    def _setup(self, shape):
+        """解像度に合わせてリングと作業バッファを確保"""
+        with self._setup_lock:
+            if self.ring is not None and self.ring.shape == tuple(shape):
+                return
+            # 使用中のスロットは古いリングを参照し続けるため、そのまま差し替えてよい
+            if self.ring is not None:
+                self._retired.append(self.ring)
+            self.ring = FrameRing(shape, self.slots, shared=self.shared, lock=self.lock)
+            h, w = shape[:2]
+            self._rgb = np.empty((h, w, 3), dtype=np.uint8)
+            self._guide = _GuideOverlay(w, h)
+
+    def _reap(self):
+        """参照のなくなった古いリングを破棄（共有メモリを unlink する）"""
+        with self._setup_lock:
+            idle = [ring for ring in self._retired if not ring.in_use()]
+            self._retired = [ring for ring in self._retired if ring not in idle]
+        for ring in idle:
+            ring.close()
+            ring.unlink()
+
+    def close(self):
+        """現在のリングと古いリングを全て破棄"""
+        with self._setup_lock:
+            rings = self._retired + ([self.ring] if self.ring is not None else [])
+            self.ring = None
+            self._retired = []
+        for ring in rings:
+            ring.close()
+            ring.unlink()
+
+    def capture(self, source):
+        """source.read() の結果をスロットへ直接書き込む。失敗時は None"""
+        if self._retired:
+            self._reap()
+        if self.ring is None:
+            ret, frame = source.read()
+            if not ret:
+                return None
+            self._setup(frame.shape)
+            slot = self.ring.acquire()
+            if slot is not None:
+                slot.array[...] = frame
+                slot.seq = getattr(source, "frame_index", None)
+            return slot
+
+        slot = self.ring.acquire()
+        if slot is None:
+            return None
+        ret, frame = source.read(slot.array)
+        if not ret:
+            slot.release()
+            return None
+        if frame is not None and not np.shares_memory(frame, slot.array):
+            # 解像度変更などでバッファが使われなかった場合
+            slot.release()
+            if frame.shape != self.ring.shape:
+                self._setup(frame.shape)
+            slot = self.ring.acquire()
+            if slot is None:
+                return None
+            slot.array[...] = frame
+        slot.seq = getattr(source, "frame_index", None)
+        return slot
+
+    def infer(self, slot, face_mesh):
+        """事前確保したRGBバッファへ変換してランドマークを抽出"""
+        rgb = self._rgb if self._rgb.shape == slot.array.shape else None
+        rgb = cv2.cvtColor(slot.array, cv2.COLOR_BGR2RGB, dst=rgb)
+        return extract_landmarks_rgb(rgb, face_mesh)
+
+    def annotate(self, slot, landmarks):
+        """ランドマークとガイドをスロット上に直接描画"""
+        if landmarks is not None:
+            draw_landmarks(slot.array, landmarks, inplace=True)
+        guide = self._guide if self._guide.size == slot.array.shape[1::-1] else _GuideOverlay(*slot.array.shape[1::-1])
+        guide.draw(slot.array)
+
+    def encode(self, slot, quality=JPEG_QUALITY):
+        """JPEG にエンコード（戻り値はエンコード結果の ndarray）"""
+        ok, buffer = cv2.imencode('.jpg', slot.array, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer if ok else None
+
+
+class _GuideOverlay:
+    """楕円ガイドの半透明描画（フレーム全体のコピーを作らず楕円の外接矩形のみ合成）"""
+    def __init__(self, w, h):
+        self.size = (w, h)
+        self.center = (w // 2, h // 2)
+        self.axes = (w // 4, h // 3)
+        cx, cy = self.center
+        ax, ay = self.axes
+        self.x0, self.y0 = max(cx - ax, 0), max(cy - ay, 0)
+        self.x1, self.y1 = min(cx + ax + 1, w), min(cy + ay + 1, h)
+        rh, rw = self.y1 - self.y0, self.x1 - self.x0
+
+        self.mask = np.zeros((rh, rw), dtype=np.uint8)
+        cv2.ellipse(self.mask, (cx - self.x0, cy - self.y0), self.axes, 0, 0, 360, 255, -1)
+        self.tint = np.empty((rh, rw, 3), dtype=np.uint8)
+        self.tint[...] = GUIDE_COLOR
+
+    def draw(self, frame):
+        roi = frame[self.y0:self.y1, self.x0:self.x1]
+        # 合成結果は呼び出しごとに確保する（複数の視聴者スレッドから同時に描画されるため共有しない）
+        blended = cv2.addWeighted(self.tint, GUIDE_ALPHA, roi, 1 - GUIDE_ALPHA, 0)
+        # 楕円内のみ ROI へ書き戻す（ROI はフレームのビューなのでその場で更新される）
+        cv2.copyTo(blended, self.mask, roi)
+        cv2.ellipse(frame, self.center, self.axes, 0, 0, 360, GUIDE_EDGE_COLOR, 2)
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+
+# ===== 推論前の簡易品質チェック設定 =====
+# 判定は縮小したグレースケール画像で行う（FaceMeshより桁違いに軽い）
+THUMBNAIL_SIZE = 320          # サムネイルの長辺（ピクセル）
+BLUR_THRESHOLD = 40.0         # ラプラシアン分散がこれ未満ならブレ/ピンぼけ
+DARK_MEAN_THRESHOLD = 40      # 平均輝度がこれ未満なら暗すぎ
+BRIGHT_MEAN_THRESHOLD = 220   # 平均輝度がこれを超えると明るすぎ
+CLIPPED_RATIO_THRESHOLD = 0.5 # 黒つぶれ/白飛び画素の割合の上限
+SHADOW_LEVEL = 16             # これ以下の輝度を黒つぶれとみなす
+HIGHLIGHT_LEVEL = 240         # これ以上の輝度を白飛びとみなす
+
+# 軽量な顔存在チェック（Haar Cascade）。横顔などを取りこぼすことがあるため既定は無効
+FACE_PRESENCE_CHECK = False
+
+QUALITY_MESSAGES = {
+    "blurry": "画像がぼやけています。カメラを固定してもう一度撮影してください",
+    "too_dark": "画像が暗すぎます。明るい場所で撮影してください",
+    "too_bright": "画像が明るすぎます。照明や逆光を調整してください",
+    "no_face": "顔が見つかりませんでした。ガイド枠に顔を合わせてください",
+}
+
+_face_cascade = None
+
+
+def _get_face_cascade():
+    """Haar Cascade を初回のみ読み込む"""
+    global _face_cascade
+    if _face_cascade is None:
+        path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        cascade = cv2.CascadeClassifier(path)
+        # 読み込みに失敗した場合は顔チェックをスキップする
+        _face_cascade = cascade if not cascade.empty() else False
+    return _face_cascade
+
+
+def make_gray_thumbnail(image, size=THUMBNAIL_SIZE):
+    """長辺 size に縮小したグレースケール画像を作成"""
+    h, w = image.shape[:2]
+    scale = size / max(h, w)
+    if scale < 1:
+        # 先に縮小してから色変換すると処理画素数が少なくて済む
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def assess_frame(image, check_face=None):
+    """フレームの品質を評価する
+
+    戻り値は {"ok", "reason", "sharpness", "brightness"} の辞書。
+    reason は QUALITY_MESSAGES のキー（問題がなければ None）。
+    """
+    if check_face is None:
+        check_face = FACE_PRESENCE_CHECK
+
+    gray = make_gray_thumbnail(image)
+
+    # 露出（ヒストグラム）
+    hist = np.bincount(gray.ravel(), minlength=256)
+    total = gray.size
+    brightness = float(np.dot(hist, np.arange(256)) / total)
+    shadows = hist[:SHADOW_LEVEL + 1].sum() / total
+    highlights = hist[HIGHLIGHT_LEVEL:].sum() / total
+
+    # ブレ（ラプラシアン分散）
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    reason = None
+    if brightness < DARK_MEAN_THRESHOLD or shadows > CLIPPED_RATIO_THRESHOLD:
+        reason = "too_dark"
+    elif brightness > BRIGHT_MEAN_THRESHOLD or highlights > CLIPPED_RATIO_THRESHOLD:
+        reason = "too_bright"
+    elif sharpness < BLUR_THRESHOLD:
+        reason = "blurry"
+    elif check_face:
+        cascade = _get_face_cascade()
+        if cascade:
+            min_side = max(24, min(gray.shape[:2]) // 8)
+            faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=3,
+                                             minSize=(min_side, min_side))
+            if len(faces) == 0:
+                reason = "no_face"
+
+    return {
+        "ok": reason is None,
+        "reason": reason,
+        "sharpness": sharpness,
+        "brightness": brightness,
+    }
+
+
+def check_frame_quality(image, check_face=None):
+    """品質チェック結果を (ok, message) で返す"""
+    quality = assess_frame(image, check_face)
+    if quality["ok"]:
+        return True, None
+    return False, QUALITY_MESSAGES[quality["reason"]]
+
+
+def select_sharpest_frame(frames, check_face=None):
+    """複数フレームから最もシャープなフレームを選ぶ
+
+    品質チェックを通過したフレームを優先し、全て不合格の場合は
+    最もシャープなフレームとその評価結果を返す。戻り値は (frame, quality)。
+    """
+    best = None
+    for frame in frames:
+        # 顔チェックは候補を絞ってから1回だけ行う
+        quality = assess_frame(frame, check_face=False)
+        key = (quality["ok"], quality["sharpness"])
+        if best is None or key > best[0]:
+            best = (key, frame, quality)
+
+    if best is None:
+        return None, None
+
+    _, frame, quality = best
+    if quality["ok"] and (FACE_PRESENCE_CHECK if check_face is None else check_face):
+        quality = assess_frame(frame, check_face=True)
+    return frame, quality
@@ -0,0 +1,209 @@
+"""差し替え可能なフレームソース
+
+Webカメラのない環境（サーバー・CI）で撮影/ストリーミング経路を動かすためのもの。
+いずれも cv2.VideoCapture と同じ read() / isOpened() / release() を持ち、
+取得したフレームの通し番号を frame_index で参照できる。
+
+    "0", "1", ...                 カメラ番号（cv2.VideoCapture）
+    "file:movie.mp4[@30]"         動画ファイル（末尾でループ。@ でFPS指定）
+    "images:captures/*_raw*.jpg[@10]" 画像列（ループ）
+    "synthetic:1280x720@30"       合成フレーム（解像度・FPS指定）
+"""
+import glob
+import re
+import time
+
+import cv2
+import numpy as np
+
+DEFAULT_FPS = 30
+MAX_SEQUENCE_IMAGES = 300   # 画像列として読み込む最大枚数
+
+_SYNTHETIC_RE = re.compile(r"^(\d+)x(\d+)(?:@(\d+(?:\.\d+)?))?$")
+
+
+def _split_fps(value, default):
+    """"path@30" を (path, 30.0) に分割"""
+    if "@" in value:
+        path, fps = value.rsplit("@", 1)
+        try:
+            return path, float(fps)
+        except ValueError:
+            pass
+    return value, default
+
+
+class CameraSource:
+    """cv2.VideoCapture に通し番号を付けただけのラッパー"""
+    def __init__(self, index):
+        self._cap = cv2.VideoCapture(index)
+        self.frame_index = -1
+
+    def read(self, image=None):
+        ret, frame = self._cap.read(image)
+        if ret:
+            self.frame_index += 1
+        return ret, frame
+
+    def __getattr__(self, name):
+        # isOpened / release / get / set などはそのまま委譲
+        return getattr(self._cap, name)
+
+
+class _PacedSource:
+    """指定FPSで実時間に合わせてフレームを出すソースの基底クラス
+
+    実カメラと同様に、読み出しが遅れた分のフレームは読み飛ばされ
+    frame_index が飛ぶ（フレーム落ちとして計測できる）。
+    """
+    def __init__(self, fps):
+        self.fps = fps
+        self.frame_index = -1
+        self._start = None
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
+
+    def _wait_next(self):
+        now = time.monotonic()
+        if self._start is None:
+            self._start = now
+            self.frame_index = 0
+            return
+        if self.fps <= 0:
+            self.frame_index += 1
+            return
+        index = max(self.frame_index + 1, int((now - self._start) * self.fps))
+        target = self._start + index / self.fps
+        if target > now:
+            time.sleep(target - now)
+        self.frame_index = index
+
+    def _render(self, index, out):
+        raise NotImplementedError
+
+    @property
+    def shape(self):
+        raise NotImplementedError
+
+    def read(self, image=None):
+        if not self._opened:
+            return False, None
+        self._wait_next()
+        # 渡されたバッファの形が合えばそこへ直接書き込む（VideoCapture.read と同じ挙動）
+        if image is None or image.shape != self.shape or image.dtype != np.uint8:
+            image = np.empty(self.shape, dtype=np.uint8)
+        if not self._render(self.frame_index, image):
+            return False, None
+        return True, image
+
+
+class SyntheticSource(_PacedSource):
+    """グラデーション背景上を図形が動く合成フレーム"""
+    def __init__(self, width, height, fps=DEFAULT_FPS):
+        super().__init__(fps)
+        self._shape = (height, width, 3)
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self._background = np.empty(self._shape, dtype=np.uint8)
+        self._background[..., 0] = x
+        self._background[..., 1] = y
+        self._background[..., 2] = 128
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def _render(self, index, out):
+        h, w = self._shape[:2]
+        np.copyto(out, self._background)
+        radius = max(8, min(w, h) // 10)
+        cx = int((w - 2 * radius) * (0.5 + 0.5 * np.sin(index / 20))) + radius
+        cy = int((h - 2 * radius) * (0.5 + 0.5 * np.cos(index / 27))) + radius
+        cv2.circle(out, (cx, cy), radius, (255, 255, 255), -1)
+        cv2.putText(out, f"#{index}", (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+        return True
+
+
+class ImageSequenceSource(_PacedSource):
+    """画像ファイル群を順に繰り返し出す（撮影済みの captures/ など）"""
+    def __init__(self, pattern, fps=DEFAULT_FPS):
+        super().__init__(fps)
+        self._frames = []
+        for path in sorted(glob.glob(pattern))[:MAX_SEQUENCE_IMAGES]:
+            img = cv2.imread(path)
+            if img is None:
+                continue
+            if self._frames and img.shape != self._frames[0].shape:
+                h, w = self._frames[0].shape[:2]
+                img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+            self._frames.append(img)
+        if not self._frames:
+            self._opened = False
+
+    @property
+    def shape(self):
+        return self._frames[0].shape
+
+    def _render(self, index, out):
+        np.copyto(out, self._frames[index % len(self._frames)])
+        return True
+
+
+class VideoFileSource(_PacedSource):
+    """動画ファイルを実時間で再生し、末尾で先頭に戻る"""
+    def __init__(self, path, fps=None):
+        self._cap = cv2.VideoCapture(path)
+        super().__init__(fps or self._cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS)
+        self._opened = self._cap.isOpened()
+        w = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self._shape = (h, w, 3)
+        self._decoded = -1
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def _render(self, index, out):
+        # 読み飛ばされたフレームもデコードは必要（シークより安価）
+        frame = out
+        while self._decoded < index:
+            ret, frame = self._cap.read(out)
+            if not ret:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self._cap.read(out)
+                if not ret:
+                    return False
+            self._decoded += 1
+        if not np.shares_memory(frame, out):
+            np.copyto(out, frame)
+        return True
+
+    def release(self):
+        super().release()
+        self._cap.release()
+
+
+def open_frame_source(spec=0):
+    """指定文字列からフレームソースを開く（書式はモジュールの説明を参照）"""
+    spec = str(spec).strip()
+    if spec.isdigit():
+        return CameraSource(int(spec))
+    if spec.startswith("synthetic:"):
+        match = _SYNTHETIC_RE.match(spec[len("synthetic:"):])
+        if not match:
+            raise ValueError(f"合成ソースの指定が不正です: {spec}")
+        w, h, fps = match.groups()
+        return SyntheticSource(int(w), int(h), float(fps) if fps else DEFAULT_FPS)
+    if spec.startswith("images:"):
+        pattern, fps = _split_fps(spec[len("images:"):], DEFAULT_FPS)
+        return ImageSequenceSource(pattern, fps)
+    if spec.startswith("file:"):
+        path, fps = _split_fps(spec[len("file:"):], None)
+        return VideoFileSource(path, fps)
+    raise ValueError(f"未知のフレームソースです: {spec}")
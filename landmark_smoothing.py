@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+
+# ===== ランドマーク時系列平滑化 =====
+# いずれのフィルタも (478, 2) などの配列全体をまとめて処理する
+# フィルタは連続したフレーム列（表示用など）向け。数フレームの窓から代表値を取る場合は
+# 初期値に引きずられるため、robust_median_landmarks に生のランドマークをそのまま渡す
+
+
+class EMAFilter:
+    """指数移動平均フィルタ"""
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self._x = None
+
+    def __call__(self, x, t=None):
+        x = np.asarray(x, dtype=np.float64)
+        if self._x is None:
+            self._x = x.copy()
+        else:
+            self._x += self.alpha * (x - self._x)
+        return self._x.copy()
+
+
+class OneEuroFilter:
+    """One-Euro フィルタ（Casiez et al. 2012）
+
+    静止時は強く平滑化してジッタを抑え、速い動きでは追従性を優先する。
+    min_cutoff / beta の単位はピクセルと秒。
+    """
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._x = None
+        self._dx = None
+        self._t = None
+
+    @staticmethod
+    def _alpha(dt, cutoff):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        x = np.asarray(x, dtype=np.float64)
+        if self._x is None:
+            self._x = x.copy()
+            self._dx = np.zeros_like(x)
+            self._t = t
+            return self._x.copy()
+
+        dt = max(t - self._t, 1e-6)
+        self._t = t
+
+        # 速度を平滑化し、速度に応じてカットオフ周波数を上げる
+        a_d = self._alpha(dt, self.d_cutoff)
+        self._dx += a_d * ((x - self._x) / dt - self._dx)
+        cutoff = self.min_cutoff + self.beta * np.abs(self._dx)
+        a = self._alpha(dt, cutoff)
+        self._x += a * (x - self._x)
+        return self._x.copy()
+
+
+def create_filter(name, **kwargs):
+    """名前からフィルタを生成（"one_euro" / "ema" / "none"）"""
+    if name == "one_euro":
+        return OneEuroFilter(**kwargs)
+    if name == "ema":
+        return EMAFilter(**kwargs)
+    if name == "none":
+        return lambda x, t=None: np.asarray(x, dtype=np.float64)
+    raise ValueError(f"未知のフィルタです: {name}")
+
+
+def robust_median_landmarks(stack, outlier_factor=3.0):
+    """(N, 478, 2) のランドマーク列からロバストな代表値を求める
+
+    一度中央値を取り、中央値から大きく外れたフレーム（瞬き・誤検出など）を
+    除外してから再度中央値を取る。戻り値は (landmarks, 採用フレームのマスク)。
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    median = np.median(stack, axis=0)
+    if len(stack) < 3:
+        return median, np.ones(len(stack), dtype=bool)
+
+    # フレームごとの中央値からの平均距離
+    errors = np.linalg.norm(stack - median, axis=2).mean(axis=1)
+    limit = outlier_factor * max(np.median(errors), 1e-6)
+    inliers = errors <= limit
+    if inliers.sum() >= 2 and not inliers.all():
+        median = np.median(stack[inliers], axis=0)
+    return median, inliers
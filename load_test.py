@@ -0,0 +1,253 @@
+"""ストリーミング/撮影経路の負荷試験
+
+サーバーを合成フレームソースで起動してから実行する（Webカメラ不要）:
+
+    FRAME_SOURCE=synthetic:1280x720@30 gunicorn app:app --threads 64
+    FRAME_SOURCE="images:captures/*_raw*.jpg@30" uvicorn asgi:app
+
+    python load_test.py --url http://127.0.0.1:8000 --viewers 50 --duration 30 \\
+        --capture-rate 0.5 --compare-rate 1 --json result.json
+
+/video_feed を N 本同時に開いてフレームを受信し、並行して /capture と
+/compare（カメラ比較）を指定レートで呼び出す。スループット・遅延・
+フレーム落ち（X-Frame-Seq の欠番）を集計して表示する。
+
+フレーム落ちは X-Frame-Seq-Scope が "broadcast"（asgi.py）の場合のみ計測する。
+Flask（app:app）では各視聴者がカメラから交互にフレームを読むため、欠番の大半は
+他の視聴者へ渡ったフレームであり、フレーム落ちとしては数えない（null と表示）。
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# 欠番をフレーム落ちとして数えてよい X-Frame-Seq-Scope（全視聴者に同じフレーム列を配信）
+BROADCAST_SCOPE = "broadcast"
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def summarize(values):
+    """遅延リスト（秒）をミリ秒の統計にまとめる"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2),
+    }
+
+
+class StreamViewer(threading.Thread):
+    """/video_feed を1本受信し、フレーム数・間隔・欠番を記録する"""
+    def __init__(self, host, port, deadline, timeout):
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.deadline = deadline
+        self.timeout = timeout
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.seq_scope = None
+        self.first_frame = None
+        self.intervals = []
+        self.error = None
+
+    def run(self):
+        start = time.monotonic()
+        try:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            conn.request("GET", "/video_feed")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                self.error = f"HTTP {resp.status}"
+                return
+            self.seq_scope = resp.getheader("X-Frame-Seq-Scope")
+            count_drops = self.seq_scope == BROADCAST_SCOPE
+            last_time = None
+            last_seq = None
+            while time.monotonic() < self.deadline:
+                headers = self._read_part_headers(resp)
+                if headers is None:
+                    break
+                length = int(headers.get("content-length", 0))
+                data = resp.read(length)
+                resp.readline()  # パート末尾の CRLF
+                now = time.monotonic()
+
+                self.frames += 1
+                self.bytes += len(data)
+                if self.first_frame is None:
+                    self.first_frame = now - start
+                if last_time is not None:
+                    self.intervals.append(now - last_time)
+                last_time = now
+
+                seq = headers.get("x-frame-seq")
+                if count_drops and seq is not None:
+                    seq = int(seq)
+                    if last_seq is not None and seq > last_seq + 1:
+                        self.dropped += seq - last_seq - 1
+                    last_seq = seq
+            conn.close()
+        except Exception as e:
+            self.error = str(e)
+
+    @staticmethod
+    def _read_part_headers(resp):
+        # 境界行までの空行を読み飛ばし、ヘッダーを空行まで読む
+        line = resp.readline()
+        while line in (b"\r\n", b"\n"):
+            line = resp.readline()
+        if not line.startswith(b"--"):
+            return None
+        headers = {}
+        while True:
+            line = resp.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+
+class ApiCaller(threading.Thread):
+    """指定レート（回/秒、ポアソン到着）で POST を送り、遅延とステータスを記録する"""
+    def __init__(self, host, port, path, rate, deadline, timeout, seed=None):
+        super().__init__(daemon=True)
+        self._rng = random.Random(seed)
+        self.host, self.port = host, port
+        self.path = path
+        self.rate = rate
+        self.deadline = deadline
+        self.timeout = timeout
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+    def run(self):
+        while True:
+            wait = self._rng.expovariate(self.rate)
+            if time.monotonic() + wait >= self.deadline:
+                break
+            time.sleep(wait)
+            start = time.monotonic()
+            try:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                conn.request("POST", self.path, body=b"{}", headers={"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                resp.read()
+                conn.close()
+                self.latencies.append(time.monotonic() - start)
+                self.statuses[resp.status] = self.statuses.get(resp.status, 0) + 1
+            except Exception:
+                self.errors += 1
+
+
+def post(host, port, path, timeout):
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    conn.request("POST", path)
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp.status, body
+
+
+def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+
+    if args.start_camera:
+        status, body = post(host, port, "/start_camera", args.timeout)
+        print(f"/start_camera: {status} {body.decode('utf-8', 'replace')}")
+
+    started = time.monotonic()
+    deadline = started + args.duration
+    viewers = [StreamViewer(host, port, deadline, args.timeout) for _ in range(args.viewers)]
+    callers = []
+    for i, (path, rate) in enumerate((("/capture", args.capture_rate), ("/compare", args.compare_rate))):
+        if rate > 0:
+            seed = None if args.seed is None else args.seed + i
+            callers.append(ApiCaller(host, port, path, rate, deadline, args.timeout, seed))
+
+    for t in viewers + callers:
+        t.start()
+    for t in viewers + callers:
+        t.join(args.duration + args.timeout)
+    elapsed = time.monotonic() - started
+
+    total_frames = sum(v.frames for v in viewers)
+    scopes = sorted({v.seq_scope for v in viewers if v.seq_scope})
+    if scopes == [BROADCAST_SCOPE]:
+        total_dropped = sum(v.dropped for v in viewers)
+        drop_ratio = round(total_dropped / max(1, total_frames + total_dropped), 4)
+    else:
+        # 視聴者ごとに独立したフレーム列でないため欠番からは算出できない
+        total_dropped = drop_ratio = None
+    report = {
+        "config": {
+            "url": args.url,
+            "viewers": args.viewers,
+            "duration_s": args.duration,
+            "capture_rate": args.capture_rate,
+            "compare_rate": args.compare_rate,
+        },
+        "stream": {
+            "connected": sum(1 for v in viewers if v.frames > 0),
+            "errors": [v.error for v in viewers if v.error],
+            "frames": total_frames,
+            "aggregate_fps": round(total_frames / elapsed, 2),
+            "per_viewer_fps": round(total_frames / elapsed / max(1, len(viewers)), 2),
+            "mbytes_per_s": round(sum(v.bytes for v in viewers) / elapsed / 1e6, 2),
+            "seq_scope": ",".join(scopes) or None,
+            "dropped_frames": total_dropped,
+            "drop_ratio": drop_ratio,
+            "time_to_first_frame": summarize([v.first_frame for v in viewers if v.first_frame is not None]),
+            "frame_interval": summarize([i for v in viewers for i in v.intervals]),
+        },
+        "api": {
+            c.path: {
+                "statuses": c.statuses,
+                "errors": c.errors,
+                "throughput_rps": round(len(c.latencies) / elapsed, 2),
+                "latency": summarize(c.latencies),
+            }
+            for c in callers
+        },
+    }
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストリーミング/撮影経路の負荷試験")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="対象サーバーのURL")
+    parser.add_argument("--viewers", type=int, default=10, help="/video_feed の同時接続数")
+    parser.add_argument("--duration", type=float, default=30, help="試験時間（秒）")
+    parser.add_argument("--capture-rate", type=float, default=0.0, help="/capture の呼び出しレート（回/秒）")
+    parser.add_argument("--compare-rate", type=float, default=0.0, help="/compare の呼び出しレート（回/秒）")
+    parser.add_argument("--timeout", type=float, default=30, help="各リクエストのタイムアウト（秒）")
+    parser.add_argument("--start-camera", action="store_true", help="開始前に /start_camera を呼ぶ")
+    parser.add_argument("--seed", type=int, default=None, help="呼び出し間隔の乱数シード（再現用）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import time
+
+import numpy as np
+
+from face_compare_heatmap import LANDMARK_POINTS
+
+# 顔の大きさの基準とする2点（顔の左端・右端）
+_FACE_LEFT = LANDMARK_POINTS['KEY_POINTS']['face_left']
+_FACE_RIGHT = LANDMARK_POINTS['KEY_POINTS']['face_right']
+
+
+class FaceTracker:
+    """フレーム間で顔に安定したIDを割り当てるトラッカー
+
+    顔の重心同士の距離（顔幅で正規化）が近いものを同一人物とみなし、
+    貪欲法で対応付ける。見失った顔は max_missed フレームまでIDを保持する。
+    IDが安定するのは連続したフレームで update した場合のみ（last_update で確認できる）。
+    """
+    def __init__(self, max_distance=0.5, max_missed=30):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.reset()
+
+    def reset(self):
+        self._next_id = 1
+        self._ids = np.zeros(0, dtype=int)
+        self._centroids = np.zeros((0, 2))
+        self._sizes = np.zeros(0)
+        self._missed = np.zeros(0, dtype=int)
+        self.last_update = None
+
+    @property
+    def active_ids(self):
+        """現在追跡中（見失ってから max_missed フレーム以内）のID"""
+        return {int(face_id) for face_id in self._ids}
+
+    def seconds_since_update(self):
+        """最後の update からの経過秒数（未更新なら None）"""
+        if self.last_update is None:
+            return None
+        return time.monotonic() - self.last_update
+
+    def update(self, faces):
+        """(F, 478, 2) の顔配列を受け取り、各顔のIDを (F,) の配列で返す"""
+        self.last_update = time.monotonic()
+        if faces is None or len(faces) == 0:
+            self._missed += 1
+            self._drop_lost()
+            return np.zeros(0, dtype=int)
+
+        faces = np.asarray(faces, dtype=np.float64)
+        centroids = faces.mean(axis=1)
+        sizes = np.linalg.norm(faces[:, _FACE_LEFT] - faces[:, _FACE_RIGHT], axis=1)
+
+        # (トラック数, 顔数) のコスト行列
+        cost = np.linalg.norm(self._centroids[:, None, :] - centroids[None, :, :], axis=2)
+        cost /= np.maximum(self._sizes[:, None], 1.0)
+
+        ids = np.zeros(len(faces), dtype=int)
+        track_used = np.zeros(len(self._ids), dtype=bool)
+        face_used = np.zeros(len(faces), dtype=bool)
+        for flat in np.argsort(cost, axis=None):
+            t, f = np.unravel_index(flat, cost.shape)
+            if cost[t, f] > self.max_distance:
+                break
+            if track_used[t] or face_used[f]:
+                continue
+            track_used[t] = face_used[f] = True
+            ids[f] = self._ids[t]
+            self._centroids[t] = centroids[f]
+            self._sizes[t] = sizes[f]
+            self._missed[t] = 0
+
+        self._missed[~track_used] += 1
+
+        # 対応しなかった顔には新しいIDを発行
+        new = np.flatnonzero(~face_used)
+        if len(new):
+            new_ids = np.arange(self._next_id, self._next_id + len(new))
+            self._next_id += len(new)
+            ids[new] = new_ids
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._centroids = np.concatenate([self._centroids, centroids[new]])
+            self._sizes = np.concatenate([self._sizes, sizes[new]])
+            self._missed = np.concatenate([self._missed, np.zeros(len(new), dtype=int)])
+
+        self._drop_lost()
+        return ids
+
+    def _drop_lost(self):
+        keep = self._missed <= self.max_missed
+        if not keep.all():
+            self._ids = self._ids[keep]
+            self._centroids = self._centroids[keep]
+            self._sizes = self._sizes[keep]
+            self._missed = self._missed[keep]
+
+
+def match_baselines(ids, baselines):
+    """IDの配列と {id: landmarks} から、基準を持つ顔の添字と基準配列を返す
+
+    戻り値は (顔の添字 (K,), 基準ランドマーク (K, 478, 2), 基準のないID一覧)。
+    """
+    index = [i for i, face_id in enumerate(ids) if int(face_id) in baselines]
+    unmatched = [int(face_id) for face_id in ids if int(face_id) not in baselines]
+    if not index:
+        return np.zeros(0, dtype=int), None, unmatched
+    past = np.stack([baselines[int(ids[i])] for i in index])
+    return np.array(index), past, unmatched
@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+
+# 再起動後に古いETagと一致しないよう、プロセスごとの識別子をETagに含める
+_BOOT_ID = os.urandom(4).hex()
+
+
+class ResultStore:
+    """バージョン付きの結果保持
+
+    更新のたびにバージョンを進め、JSONへのシリアライズはバージョンごとに1回だけ行う。
+    変更の通知（ロングポーリング/SSE）用にリスナーを提供する。
+    """
+    def __init__(self, **initial):
+        self._lock = threading.Lock()
+        self._values = dict(initial)
+        self._listeners = []
+        self.version = 0
+        self._snapshot = None
+
+    def get(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def update(self, **values):
+        """結果を更新し、リスナーに通知"""
+        with self._lock:
+            self._values.update(values)
+            self.version += 1
+            self._snapshot = None
+            version = self.version
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(version)
+
+    def snapshot(self):
+        """(version, etag, JSONバイト列) を返す（同一バージョンではキャッシュを再利用）"""
+        with self._lock:
+            if self._snapshot is None:
+                body = json.dumps(self._values, ensure_ascii=False).encode("utf-8")
+                etag = f'"{_BOOT_ID}-{self.version}"'
+                self._snapshot = (self.version, etag, body)
+            return self._snapshot
+
+    def add_listener(self, listener):
+        """更新時に listener(version) を呼び出す（更新したスレッドで実行される）"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def version_for_etag(self, if_none_match):
+        """If-None-Match が現在のETagと一致すればそのバージョン、なければ None"""
+        if not if_none_match:
+            return None
+        version, etag, _ = self.snapshot()
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # 弱いETag（W/ 付き）も同一とみなす
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return version
+        return None
+
+
+def sse_event_id(etag):
+    """ETag（プロセス識別子付き）から SSE のイベントIDを作る
+
+    再起動後や別ワーカーへの再接続で Last-Event-ID がたまたま同じ番号になっても
+    一致しないよう、バージョン番号単独ではなくETagと同じ値を使う。
+    """
+    return etag.strip('"')
+
+
+def format_sse(event_id, body):
+    """SSE イベントを組み立てる"""
+    return b"id: " + event_id.encode() + b"\nevent: results\ndata: " + body + b"\n\n"